@@ -3,33 +3,730 @@
 
 import argparse
 import asyncio
+import collections
+import concurrent.futures
+import copy
 import datetime
+import functools
+import hashlib
+import inspect
 import json
+import math
 import os
+import queue
+import signal
 import ssl
 import sys
 import threading
+import time
+import traceback
 import uuid
 from base64 import b64encode, b64decode
 from io import BytesIO
 from pathlib import Path
-from time import clock
+
+# IMPORTS_STARTED_AT is used by startup profile to measure time, spent on heavy imports below.
+IMPORTS_STARTED_AT = time.perf_counter()
+
+import sqlite3
 
 import janus
 import yaml
-from PIL import Image
 from PyQt5 import QtGui, QtNetwork, QtCore
-from PyQt5.QtCore import Qt, pyqtSignal, QObject, QRect, QPoint
-from PyQt5.QtGui import QIcon, QPixmap, QFont, QPainter, QPaintEvent, QPen, QMouseEvent
+from PyQt5.QtCore import Qt, pyqtSignal, QObject, QRect, QPoint, QBuffer, QIODevice
+from PyQt5.QtGui import QIcon, QPixmap, QFont, QPainter, QPaintEvent, QPen, QMouseEvent, QImage
 from PyQt5.QtWidgets import QApplication, QWidget, QGridLayout, QLabel, QLineEdit, QTabWidget, QPushButton, QMessageBox, \
-    QFileDialog, QMainWindow, QAction
-from aiohttp import web, ClientSession
+    QFileDialog, QMainWindow, QAction, QComboBox, QTableWidget, QTableWidgetItem, QAbstractItemView
+from aiohttp import web, ClientSession, ClientTimeout
+
+
+def encode_image_file(fname: str) -> str:
+    """Returns image from file, re-encoded to PNG and base64 encoded, as FaceDB expects."""
+    from PIL import Image
+    img = Image.open(fname)
+    bytes_io = BytesIO()
+    img.save(bytes_io, format='PNG')
+    img_buff = str(b64encode(bytes_io.getvalue()))
+    return img_buff[2:len(img_buff) - 1]
+
+
+def image_dhash(img_buff: str) -> int:
+    """Returns 64-bit difference hash of base64 encoded image.
+
+    Hash is stable under re-encoding and small changes of scene, so similar images have close (in Hamming distance)
+    hashes. Function is CPU bound and is called from executor, not from event loop.
+    """
+    from PIL import Image
+    img = Image.open(BytesIO(b64decode(img_buff)))
+    # JPEG images are decoded in reduced size, that is much faster for big frames.
+    img.draft('L', (DuplicateFilter.HASH_WIDTH * 4, DuplicateFilter.HASH_HEIGHT * 4))
+    img = img.convert('L').resize((DuplicateFilter.HASH_WIDTH + 1, DuplicateFilter.HASH_HEIGHT), Image.LANCZOS)
+    return dhash_pixels(list(img.getdata()))
+
+
+def dhash_pixels(pixels: list) -> int:
+    """Returns difference hash of (HASH_WIDTH + 1) x HASH_HEIGHT grayscale pixels, given row by row."""
+    h = 0
+    for row in range(DuplicateFilter.HASH_HEIGHT):
+        offset = row * (DuplicateFilter.HASH_WIDTH + 1)
+        for col in range(DuplicateFilter.HASH_WIDTH):
+            h = (h << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return h
+
+
+def encode_video_frame(frame) -> str:
+    """Returns decoded video frame, encoded to PNG and base64 encoded, as FaceDB expects."""
+    import cv2
+    ok, buff = cv2.imencode('.png', frame)
+    if not ok:
+        raise ValueError('unable to encode video frame')
+    return b64encode(buff.tobytes()).decode()
+
+
+def format_video_ts(ts: float) -> str:
+    minutes, seconds = divmod(ts, 60)
+    hours, minutes = divmod(int(minutes), 60)
+    return '%02d:%02d:%06.3f' % (hours, minutes, seconds)
+
+
+class StartupProfile:
+    """StartupProfile class collects timings of startup phases from all threads."""
+
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self.started_at = IMPORTS_STARTED_AT
+        self.phases = []
+        self.lock = threading.Lock()
+
+    def add(self, name: str, begin: float, end: float):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.phases.append((begin, end, name, threading.current_thread().name))
+
+    def phase(self, name: str):
+        return StartupPhase(self, name)
+
+    def report(self):
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        with self.lock:
+            phases = sorted(self.phases)
+        print('startup profile:', file=sys.stderr)
+        for begin, end, name, thread_name in phases:
+            print('  %-24s %-12s start %8.1f ms, took %8.1f ms' %
+                  (name, thread_name, (begin - self.started_at) * 1000, (end - begin) * 1000), file=sys.stderr)
+        print('  %-24s %-12s %23.1f ms' % ('ready', threading.current_thread().name,
+                                            (now - self.started_at) * 1000), file=sys.stderr)
+
+
+class StartupPhase:
+    def __init__(self, profile: StartupProfile, name: str):
+        self.profile = profile
+        self.name = name
+        self.begin = 0.0
+
+    def __enter__(self):
+        self.begin = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.profile.add(self.name, self.begin, time.perf_counter())
+
+
+class StallWatchdog(threading.Thread):
+    """StallWatchdog class detects stalls of event loops (Qt one and asyncio one).
+
+    Every watched loop calls beat() each interval_s seconds. If loop didn't call it
+    for more than threshold_s seconds, watchdog prints stack of stalled thread.
+    """
+
+    def __init__(self, interval_s: float, threshold_s: float):
+        super().__init__(name='watchdog')
+        self.daemon = True
+        self.interval_s = interval_s
+        self.threshold_s = threshold_s
+        self.lock = threading.Lock()
+        # loops maps loop name to its thread id, time of last beat, lag and stalls statistics.
+        self.loops = {}
+
+    def watch(self, name: str):
+        """Registers loop, running in current thread."""
+        with self.lock:
+            self.loops[name] = {
+                'thread_id': threading.get_ident(),
+                'ts': time.monotonic(),
+                'stalled': False,
+                'last_lag_s': 0.0,
+                'max_lag_s': 0.0,
+                'stalls': 0
+            }
+
+    def unwatch(self, name: str):
+        """Unregisters loop, that is stopped."""
+        with self.lock:
+            self.loops.pop(name, None)
+
+    def beat(self, name: str, lag_s: float):
+        """Is called by loop: lag_s is delay of heartbeat callback in comparison with its schedule."""
+        with self.lock:
+            state = self.loops[name]
+            now = time.monotonic()
+            if state['stalled']:
+                print('%s loop recovered after %.1f ms' % (name, (now - state['ts']) * 1000), file=sys.stderr)
+                state['stalled'] = False
+            state['ts'] = now
+            state['last_lag_s'] = lag_s
+            state['max_lag_s'] = max(state['max_lag_s'], lag_s)
+
+    def run(self):
+        while True:
+            time.sleep(self.interval_s)
+            now = time.monotonic()
+            frames = None
+            with self.lock:
+                for name, state in self.loops.items():
+                    if state['stalled'] or now - state['ts'] < self.threshold_s:
+                        continue
+                    state['stalled'] = True
+                    state['stalls'] += 1
+                    if frames is None:
+                        frames = sys._current_frames()
+                    frame = frames.get(state['thread_id'])
+                    stack = ''.join(traceback.format_stack(frame)) if frame is not None else ''
+                    print('%s loop stalled for %.1f ms:\n%s' % (name, (now - state['ts']) * 1000, stack),
+                          file=sys.stderr)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {name: {
+                'stalled': state['stalled'],
+                'stalls': state['stalls'],
+                'last_lag_ms': state['last_lag_s'] * 1000,
+                'max_lag_ms': state['max_lag_s'] * 1000
+            } for name, state in self.loops.items()}
+
+
+class SamplingProfiler:
+    """SamplingProfiler class periodically samples stacks of all threads.
+
+    Profile is written in collapsed stacks format ("thread;func (file:line);... count" lines),
+    which is understood by flamegraph.pl, speedscope and similar tools.
+    """
+
+    def __init__(self, interval_s: float, out_dir: str):
+        self.interval_s = interval_s
+        self.out_dir = out_dir
+        self.lock = threading.Lock()
+        self.stop_event = None
+
+    def is_running(self) -> bool:
+        with self.lock:
+            return self.stop_event is not None
+
+    def start(self, duration_s: float) -> str:
+        """Starts profiling for duration_s seconds. Returns name of profile file or empty string."""
+        with self.lock:
+            if self.stop_event is not None:
+                return ''
+            self.stop_event = threading.Event()
+            fname = os.path.join(self.out_dir, 'controlpanel-%s.folded' %
+                                 datetime.datetime.now().strftime('%Y%m%d-%H%M%S'))
+            t = threading.Thread(target=self.__sample, args=(fname, duration_s, self.stop_event),
+                                 name='profiler')
+            t.daemon = True
+            t.start()
+            return fname
+
+    def stop(self):
+        with self.lock:
+            if self.stop_event is not None:
+                self.stop_event.set()
+
+    def __sample(self, fname: str, duration_s: float, stop_event: threading.Event):
+        stacks = collections.Counter()
+        own_id = threading.get_ident()
+        deadline = time.monotonic() + duration_s
+        while not stop_event.is_set() and time.monotonic() < deadline:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append('%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename),
+                                                 code.co_firstlineno))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                stacks[';'.join(reversed(stack))] += 1
+            stop_event.wait(self.interval_s)
+        with open(fname, 'w') as out:
+            for stack, count in stacks.most_common():
+                out.write('%s %d\n' % (stack, count))
+        with self.lock:
+            self.stop_event = None
+        print('profile is written to "%s"' % fname, file=sys.stderr)
+
+
+class HistoryStore(threading.Thread):
+    """HistoryStore class keeps decided reviews in local SQLite database for offline lookups.
+
+    Reviews are written by this thread in batches, every other thread reads database
+    with its own connection (database is in WAL mode, so reads don't wait for writes).
+    Review is a dict with "uuid", "status", "image_control_objects" and "img_bytes"
+    (or base64 encoded "img_buff") keys. Thumbnails are made by this thread too, so GUI doesn't wait for scaling.
+    """
+
+    SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS reviews (
+        id INTEGER PRIMARY KEY,
+        uuid TEXT NOT NULL,
+        ts REAL NOT NULL,
+        command TEXT NOT NULL,
+        img_hash TEXT NOT NULL,
+        image_control_objects TEXT NOT NULL,
+        thumbnail BLOB
+    );
+    CREATE INDEX IF NOT EXISTS reviews_uuid ON reviews (uuid);
+    CREATE INDEX IF NOT EXISTS reviews_img_hash ON reviews (img_hash);
+    CREATE INDEX IF NOT EXISTS reviews_ts ON reviews (ts);
+    CREATE TABLE IF NOT EXISTS faces (
+        review_id INTEGER NOT NULL REFERENCES reviews (id) ON DELETE CASCADE,
+        passport TEXT NOT NULL,
+        surname TEXT NOT NULL,
+        name TEXT NOT NULL,
+        patronymic TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS faces_review_id ON faces (review_id);
+    CREATE INDEX IF NOT EXISTS faces_passport ON faces (passport);
+    CREATE INDEX IF NOT EXISTS faces_surname ON faces (surname);
+    '''
+
+    FIELD_PASSPORT = 'passport'
+    FIELD_SURNAME = 'surname'
+    FIELD_UUID = 'uuid'
+    FIELD_IMG_HASH = 'img_hash'
+    FIELDS = (FIELD_PASSPORT, FIELD_SURNAME, FIELD_UUID, FIELD_IMG_HASH)
+
+    BATCH_SIZE = 256
+    PRUNE_INTERVAL_S = 60
+
+    def __init__(self, path: str, max_rows: int, max_age_days: float, thumbnail_size: int = 0):
+        super().__init__(name='history')
+        self.daemon = True
+        self.path = path
+        self.max_rows = max_rows
+        self.max_age_days = max_age_days
+        self.thumbnail_size = thumbnail_size
+        self.reviews = queue.Queue()
+        self.local = threading.local()
+        conn = self.connection()
+        conn.executescript(HistoryStore.SCHEMA)
+        conn.commit()
+
+    @staticmethod
+    def img_hash(img_bytes: bytes) -> str:
+        return hashlib.sha1(img_bytes).hexdigest()
+
+    def connection(self) -> sqlite3.Connection:
+        """Returns connection of current thread."""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA foreign_keys=ON')
+            self.local.conn = conn
+        return conn
+
+    def record(self, review: dict):
+        self.reviews.put((time.time(), review))
+
+    def run(self):
+        conn = self.connection()
+        pruned_at = 0.0
+        while True:
+            batch = [self.reviews.get()]
+            while len(batch) < HistoryStore.BATCH_SIZE and not self.reviews.empty():
+                batch.append(self.reviews.get())
+            # Images are decoded and scaled before transaction is started, so readers don't wait for it.
+            rows = []
+            for ts, review in batch:
+                img_bytes = review.get('img_bytes')
+                if img_bytes is None:
+                    img_bytes = b64decode(review['img_buff'])
+                rows.append((ts, review, img_bytes, self.thumbnail_of(img_bytes)))
+            try:
+                with conn:
+                    for ts, review, img_bytes, thumbnail in rows:
+                        self.__insert(conn, ts, review, img_bytes, thumbnail)
+                if time.monotonic() - pruned_at > HistoryStore.PRUNE_INTERVAL_S:
+                    with conn:
+                        self.__prune(conn)
+                    pruned_at = time.monotonic()
+            except sqlite3.Error as e:
+                print('unable to write history: %s' % e, file=sys.stderr)
+
+    def thumbnail_of(self, img_bytes: bytes) -> bytes:
+        if self.thumbnail_size <= 0:
+            return None
+        img = QImage.fromData(img_bytes)
+        if img.isNull():
+            return None
+        img = img.scaled(self.thumbnail_size, self.thumbnail_size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        buff = QBuffer()
+        buff.open(QIODevice.WriteOnly)
+        img.save(buff, 'PNG')
+        return bytes(buff.data())
+
+    @staticmethod
+    def __insert(conn: sqlite3.Connection, ts: float, review: dict, img_bytes: bytes, thumbnail: bytes):
+        image_control_objects = review['image_control_objects'] or []
+        cur = conn.execute('''INSERT INTO reviews (uuid, ts, command, img_hash, image_control_objects, thumbnail)
+                              VALUES (?, ?, ?, ?, ?, ?)''',
+                           (review['uuid'], ts, review['status'], HistoryStore.img_hash(img_bytes),
+                            json.dumps(image_control_objects, ensure_ascii=False), thumbnail))
+        faces = []
+        for ico in image_control_objects:
+            cob = ico.get('control_object', {})
+            faces.append((cur.lastrowid, cob.get('passport', '-'), cob.get('surname', '-'),
+                          cob.get('name', '-'), cob.get('patronymic', '-')))
+        conn.executemany('''INSERT INTO faces (review_id, passport, surname, name, patronymic)
+                            VALUES (?, ?, ?, ?, ?)''', faces)
+
+    def __prune(self, conn: sqlite3.Connection):
+        if self.max_age_days > 0:
+            conn.execute('DELETE FROM reviews WHERE ts < ?', (time.time() - self.max_age_days * 24 * 3600,))
+        if self.max_rows > 0:
+            conn.execute('''DELETE FROM reviews WHERE id <= (
+                              SELECT id FROM reviews ORDER BY id DESC LIMIT 1 OFFSET ?)''', (self.max_rows,))
+
+    def search(self, field: str, value: str, limit: int) -> list:
+        """Returns (review id, ts, command, uuid, passport, surname, name, patronymic) tuples, newest first.
+
+        Surname is searched by prefix, other fields are matched exactly. Image hash may be tuple of hashes.
+        """
+        query = '''SELECT r.id, r.ts, r.command, r.uuid, f.passport, f.surname, f.name, f.patronymic
+                   FROM reviews r LEFT JOIN faces f ON f.review_id = r.id '''
+        if field == HistoryStore.FIELD_PASSPORT:
+            query += 'WHERE r.id IN (SELECT review_id FROM faces WHERE passport = ?) '
+            args = (value,)
+        elif field == HistoryStore.FIELD_SURNAME:
+            # Range condition (unlike LIKE) uses index.
+            query += 'WHERE r.id IN (SELECT review_id FROM faces WHERE surname >= ? AND surname < ?) '
+            args = (value, value + '\U0010ffff')
+        elif field == HistoryStore.FIELD_UUID:
+            query += 'WHERE r.uuid = ? '
+            args = (value,)
+        elif field == HistoryStore.FIELD_IMG_HASH:
+            args = tuple(value) if isinstance(value, (list, tuple)) else (value,)
+            query += 'WHERE r.img_hash IN (%s) ' % ', '.join('?' * len(args))
+        else:
+            raise ValueError('unknown history field "%s"' % field)
+        query += 'ORDER BY r.ts DESC LIMIT ?'
+        return self.connection().execute(query, args + (limit,)).fetchall()
+
+    def thumbnail(self, review_id: int) -> bytes:
+        row = self.connection().execute('SELECT thumbnail FROM reviews WHERE id = ?', (review_id,)).fetchone()
+        return row[0] if row is not None else None
 
 
 class UserTrigger(QObject):
     sig = pyqtSignal()
 
 
+class VideoFrameSampler(threading.Thread):
+    """VideoFrameSampler class decodes video file and samples frames for Find.
+
+    Frame is sampled every frame_interval_s seconds of video and on scene change, when difference hash of frame
+    differs from hash of the last sampled frame in more than scene_change_distance bits. Frames, that are neither
+    sampled nor checked for scene change, are only grabbed, so they are not converted to BGR images and copied.
+    Sampled frames wait in bounded queue, so decoding waits for encoding and sending and memory doesn't grow
+    with video length.
+
+    Sampler is iterable of FindBatchWindow jobs, iteration never blocks: None means, that next frame
+    is not sampled yet, on_sampled is called (from sampler's thread), when it is.
+    """
+
+    def __init__(self, fname: str, find_cfg, on_sampled=None):
+        super().__init__(name='video_sampler')
+        self.daemon = True
+        self.fname = fname
+        self.cfg = find_cfg
+        self.on_sampled = on_sampled
+        self.frames = queue.Queue(maxsize=self.cfg.video_queue_size)
+        self.stopped = threading.Event()
+        self.exhausted = False
+
+    def run(self):
+        import cv2
+        cap = cv2.VideoCapture(self.fname)
+        try:
+            last_ts = None
+            last_hash = None
+            checked_ts = None
+            while not self.stopped.is_set() and cap.grab():
+                ts = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+                due = last_ts is None or \
+                    (self.cfg.video_frame_interval_s > 0 and ts - last_ts >= self.cfg.video_frame_interval_s)
+                check = self.cfg.video_scene_change_distance > 0 and \
+                    (checked_ts is None or ts - checked_ts >= self.cfg.video_scene_check_interval_s)
+                if not due and not check:
+                    continue
+                ok, frame = cap.retrieve()
+                if not ok:
+                    continue
+                h = None
+                if self.cfg.video_scene_change_distance > 0:
+                    checked_ts = ts
+                    small = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY),
+                                       (DuplicateFilter.HASH_WIDTH + 1, DuplicateFilter.HASH_HEIGHT),
+                                       interpolation=cv2.INTER_AREA)
+                    h = dhash_pixels(small.flatten().tolist())
+                    if last_hash is not None and \
+                            DuplicateFilter.distance(h, last_hash) > self.cfg.video_scene_change_distance:
+                        due = True
+                if not due:
+                    continue
+                last_ts = ts
+                last_hash = h
+                self.put((ts, frame))
+        except Exception as e:
+            print('unable to sample frames of "%s": %s' % (self.fname, e), file=sys.stderr)
+        finally:
+            cap.release()
+            self.put(None)
+
+    def put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.frames.put(item, timeout=0.1)
+            except queue.Full:
+                continue
+            if self.on_sampled is not None:
+                self.on_sampled()
+            return
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.exhausted:
+            raise StopIteration
+        try:
+            item = self.frames.get_nowait()
+        except queue.Empty:
+            return None
+        if item is None:
+            self.exhausted = True
+            raise StopIteration
+        ts, frame = item
+        return format_video_ts(ts), functools.partial(encode_video_frame, frame)
+
+    def close(self):
+        self.stopped.set()
+
+
+class ExportProgress(QObject):
+    # (job name, done items, total items)
+    progress = pyqtSignal(str, int, int)
+    # (job name, error text or empty string)
+    finished = pyqtSignal(str, str)
+
+
+def image_ext(img_bytes: bytes) -> str:
+    if img_bytes.startswith(b'\x89PNG'):
+        return 'png'
+    if img_bytes.startswith(b'\xff\xd8'):
+        return 'jpg'
+    if img_bytes.startswith(b'GIF8'):
+        return 'gif'
+    if img_bytes.startswith(b'BM'):
+        return 'bmp'
+    return 'img'
+
+
+class ExportWorker(threading.Thread):
+    """ExportWorker class writes reviews to disk in background, so GUI doesn't freeze on big images.
+
+    Review is a dict with "uuid", "win_name", "status", "image_control_objects" and "img_bytes"
+    (original encoded image) keys.
+    """
+
+    INDEX_NAME = 'index.jsonl'
+
+    def __init__(self, keep_original: bool):
+        super().__init__(name='export_worker')
+        self.daemon = True
+        self.keep_original = keep_original
+        self.jobs = queue.Queue()
+        self.signals = ExportProgress()
+
+    def run(self):
+        while True:
+            name, job, args = self.jobs.get()
+            try:
+                job(name, *args)
+                self.signals.finished.emit(name, '')
+            except Exception as e:
+                self.signals.finished.emit(name, str(e))
+
+    def save_review(self, dname: str, review: dict):
+        self.jobs.put(('save "%s"' % dname, self.__save_review, (dname, review)))
+
+    def export_reviews(self, fname: str, reviews: list):
+        self.jobs.put(('export "%s"' % fname, self.__export_reviews, (fname, reviews)))
+
+    def encode(self, img_bytes: bytes):
+        """Returns image bytes and extension: original bytes or PNG, re-encoded in this thread."""
+        if self.keep_original:
+            return img_bytes, image_ext(img_bytes)
+        img = QImage.fromData(img_bytes)
+        buff = QBuffer()
+        buff.open(QIODevice.WriteOnly)
+        img.save(buff, 'PNG')
+        return bytes(buff.data()), 'png'
+
+    def __save_review(self, name: str, dname: str, review: dict):
+        self.signals.progress.emit(name, 0, 1)
+        os.mkdir(dname)
+        img_bytes, ext = self.encode(review['img_bytes'])
+        with open(os.path.join(dname, 'img.' + ext), 'wb') as out:
+            out.write(img_bytes)
+        data_name = os.path.join(dname, 'faces.json')
+        with open(data_name, 'w') as out:
+            json.dump({'image_control_objects': review['image_control_objects']}, out,
+                      ensure_ascii=False, indent=4, sort_keys=True)
+        self.signals.progress.emit(name, 1, 1)
+
+    def __export_reviews(self, name: str, fname: str, reviews: list):
+        """Writes images one by one to tar (or zip) archive and JSONL index as its last member."""
+        # Archive modules are needed only for export, so they are not imported at startup.
+        import tarfile
+        import zipfile
+        use_zip = fname.endswith('.zip')
+        if use_zip:
+            archive = zipfile.ZipFile(fname, 'w', zipfile.ZIP_STORED)
+        else:
+            archive = tarfile.open(fname, 'w|')
+        index = []
+        try:
+            for i in range(len(reviews)):
+                review = reviews[i]
+                img_bytes, ext = self.encode(review['img_bytes'])
+                img_name = '%06d.%s' % (i, ext)
+                self.__add_member(archive, img_name, img_bytes)
+                index.append(json.dumps({
+                    'uuid': review['uuid'],
+                    'win_name': review['win_name'],
+                    'status': review['status'],
+                    'image': img_name,
+                    'image_control_objects': review['image_control_objects']
+                }, ensure_ascii=False, sort_keys=True))
+                self.signals.progress.emit(name, i + 1, len(reviews))
+            self.__add_member(archive, ExportWorker.INDEX_NAME, ('\n'.join(index) + '\n').encode('utf-8'))
+        finally:
+            archive.close()
+
+    @staticmethod
+    def __add_member(archive, member_name: str, data: bytes):
+        import tarfile
+        import zipfile
+        if isinstance(archive, zipfile.ZipFile):
+            archive.writestr(member_name, data)
+            return
+        info = tarfile.TarInfo(member_name)
+        info.size = len(data)
+        info.mtime = time.time()
+        archive.addfile(info, BytesIO(data))
+
+
+class PriorityScheduler:
+    """PriorityScheduler class passes notifications from HTTP server to GUI.
+
+    Results of operator's own requests go first, then "process_again" round-trips,
+    then unsolicited (background) notifications. Every aging_s seconds of waiting raise
+    item's priority by one class, so background notifications are never starved.
+    """
+
+    CLASS_FIND = 'find'
+    CLASS_PROCESS_AGAIN = 'process_again'
+    CLASS_BACKGROUND = 'background'
+    CLASSES = (CLASS_FIND, CLASS_PROCESS_AGAIN, CLASS_BACKGROUND)
+
+    def __init__(self, aging_s: float, expected_ttl_s: float = 3600):
+        self.aging_s = aging_s
+        self.expected_ttl_s = expected_ttl_s
+        self.lock = threading.Lock()
+        self.queues = {cls: collections.deque() for cls in PriorityScheduler.CLASSES}
+        # expected maps uuid of request, sent by operator, to class of its notification and time of request.
+        # Requests, that got no notification in expected_ttl_s seconds, are forgotten.
+        self.expected = collections.OrderedDict()
+        self.waits = {cls: {'count': 0, 'total_s': 0.0, 'max_s': 0.0} for cls in PriorityScheduler.CLASSES}
+
+    def expect(self, req_uuid: str, cls: str):
+        now = time.monotonic()
+        with self.lock:
+            while len(self.expected) != 0 and next(iter(self.expected.values()))[1] < now - self.expected_ttl_s:
+                self.expected.popitem(last=False)
+            self.expected[req_uuid] = (cls, now)
+            self.expected.move_to_end(req_uuid)
+
+    def forget(self, req_uuid: str):
+        """Is called, when request failed and its notification will never come."""
+        with self.lock:
+            self.expected.pop(req_uuid, None)
+
+    def is_expected(self, req_uuid: str) -> bool:
+        """Returns True, if notification is result of operator's own request."""
+        with self.lock:
+            return req_uuid in self.expected
+
+    def put(self, p: tuple):
+        req_uuid = p[1].get('header', {}).get('uuid')
+        with self.lock:
+            cls, _ = self.expected.pop(req_uuid, (PriorityScheduler.CLASS_BACKGROUND, 0))
+            self.queues[cls].append((time.monotonic(), p))
+
+    def get(self) -> tuple:
+        now = time.monotonic()
+        with self.lock:
+            best_cls = None
+            best_score = 0.0
+            for rank in range(len(PriorityScheduler.CLASSES)):
+                cls = PriorityScheduler.CLASSES[rank]
+                if len(self.queues[cls]) == 0:
+                    continue
+                score = rank - (now - self.queues[cls][0][0]) / self.aging_s
+                if best_cls is None or score < best_score:
+                    best_cls = cls
+                    best_score = score
+            ts, p = self.queues[best_cls].popleft()
+            wait = self.waits[best_cls]
+            wait['count'] += 1
+            wait['total_s'] += now - ts
+            wait['max_s'] = max(wait['max_s'], now - ts)
+            return p
+
+    def qsize(self) -> int:
+        with self.lock:
+            return sum(len(q) for q in self.queues.values())
+
+    def stats(self) -> dict:
+        stats = {}
+        with self.lock:
+            for cls in PriorityScheduler.CLASSES:
+                wait = self.waits[cls]
+                stats[cls] = {
+                    'pending': len(self.queues[cls]),
+                    'count': wait['count'],
+                    'mean_wait_ms': wait['total_s'] / wait['count'] * 1000 if wait['count'] != 0 else 0.0,
+                    'max_wait_ms': wait['max_s'] * 1000
+                }
+        return stats
+
+
 class FaceBox:
     def __init__(self, box_list: list):
         self.top = box_list[0]
@@ -167,16 +864,39 @@ class FaceTab(QWidget):
 
 
 class MainWindow(QMainWindow):
-    def __init__(self, app: QApplication, mq: janus.Queue, app_name: str,
+    def __init__(self, app: QApplication, scheduler: PriorityScheduler, app_name: str,
                  static_path: str, width_coef: float, height_coef: float, guide_text: str, src_addr: str,
-                 facedb_addr: str):
+                 facedb_addr: str, export_cfg, watchdog: StallWatchdog, profiler: SamplingProfiler,
+                 profile_duration_s: float, history: HistoryStore, history_cfg, find_cfg):
         super().__init__()
 
         self.app = app
-        self.mq = mq
+        self.scheduler = scheduler
+        self.watchdog = watchdog
+        self.profiler = profiler
+        self.profile_duration_s = profile_duration_s
+        self.history = history
+        self.history_cfg = history_cfg
+        self.history_window = None
+        self.find_cfg = find_cfg
+        self.encode_pool = None
+        # pending_replies maps put_image reply of batch find to its batch window and image index.
+        self.pending_replies = {}
+        # find_replies maps put_image reply of single image find to its uuid.
+        self.find_replies = {}
+        # batch_reviews maps uuid of reviewed batch result to its batch window and image index.
+        self.batch_reviews = {}
+        self.batch_windows = []
 
         self.awaiting_control_objects = {}
         self.awaiting_controls = {}
+        self.decided_reviews = collections.deque()
+        self.decided_bytes = 0
+        self.export_cfg = export_cfg
+        # Export worker and network manager are created on first use to speed up startup.
+        self.export_worker = None
+        self.network_manager = None
+        self.icons = {}
 
         self.app_name = app_name
         self.static_path = static_path
@@ -187,7 +907,7 @@ class MainWindow(QMainWindow):
         screen_size = screen.size()
         self.w_size = (int(screen_size.width() * self.width_coef), int(screen_size.height() * self.height_coef))
 
-        self.info_widget = InfoWidget(os.path.join(static_path, 'logo', 'logo.png'), self.w_size, guide_text)
+        self.info_widget = InfoWidget(os.path.join(self.static_path, 'logo', 'logo.png'), self.w_size, guide_text)
 
         self.src_addr = src_addr
         self.facedb_addr = facedb_addr
@@ -201,12 +921,9 @@ class MainWindow(QMainWindow):
         self.resize(*self.w_size)
         self.setFont(QFont("DejaVu Sans Mono", 12, QtGui.QFont.PreferDefault))
         self.setWindowTitle(self.app_name)
-        self.setWindowIcon(QIcon(os.path.join(self.static_path, 'logo', 'logo.png')))
-
-        self.network_manager = QtNetwork.QNetworkAccessManager()
-        self.network_manager.finished.connect(self.handle_response)
+        self.setWindowIcon(self.icon('logo', 'logo.png'))
 
-        quit_action = QAction(QIcon(os.path.join(self.static_path, 'icons', 'quit.png')),
+        quit_action = QAction(self.icon('icons', 'quit.png'),
                               'Quit ControlPanel.', self)
         quit_action.setShortcut('Ctrl+Q')
         quit_action.triggered.connect(self.__quit_action_started)
@@ -214,7 +931,7 @@ class MainWindow(QMainWindow):
         self.toolbar = self.addToolBar('Quit')
         self.toolbar.addAction(self.quit_action)
 
-        upload_action = QAction(QIcon(os.path.join(self.static_path, 'icons', 'upload.png')),
+        upload_action = QAction(self.icon('icons', 'upload.png'),
                                 'Upload new FaceData to FaceDB.', self)
         upload_action.triggered.connect(self.__upload_action_started)
         upload_action.setShortcut('Ctrl+U')
@@ -222,7 +939,7 @@ class MainWindow(QMainWindow):
         self.toolbar = self.addToolBar('Upload')
         self.toolbar.addAction(self.upload_action)
 
-        find_action = QAction(QIcon(os.path.join(self.static_path, 'icons', 'find.png')),
+        find_action = QAction(self.icon('icons', 'find.png'),
                               'Find human by face.', self)
         find_action.triggered.connect(self.__find_action_started)
         find_action.setShortcut('Ctrl+F')
@@ -230,11 +947,106 @@ class MainWindow(QMainWindow):
         self.toolbar = self.addToolBar('Find')
         self.toolbar.addAction(self.find_action)
 
+        find_dir_action = QAction('Find in folder', self)
+        find_dir_action.setToolTip('Find humans by faces from all images in folder.')
+        find_dir_action.triggered.connect(self.__find_dir_action_started)
+        find_dir_action.setShortcut('Ctrl+Shift+F')
+        self.find_dir_action = find_dir_action
+        self.toolbar.addAction(self.find_dir_action)
+
+        find_video_action = QAction('Find in video', self)
+        find_video_action.setToolTip('Find humans by faces from sampled frames of video.')
+        find_video_action.triggered.connect(self.__find_video_action_started)
+        find_video_action.setShortcut('Ctrl+Shift+V')
+        self.find_video_action = find_video_action
+        self.toolbar.addAction(self.find_video_action)
+
+        export_action = QAction('Export', self)
+        export_action.setToolTip('Export all pending and decided reviews to archive.')
+        export_action.triggered.connect(self.__export_action_started)
+        export_action.setShortcut('Ctrl+E')
+        self.export_action = export_action
+        self.toolbar = self.addToolBar('Export')
+        self.toolbar.addAction(self.export_action)
+
+        if self.history is not None:
+            history_action = QAction('History', self)
+            history_action.setToolTip('Search decided reviews in local history.')
+            history_action.triggered.connect(self.__history_action_started)
+            history_action.setShortcut('Ctrl+H')
+            self.history_action = history_action
+            self.toolbar = self.addToolBar('History')
+            self.toolbar.addAction(self.history_action)
+
+        profile_action = QAction('Profile', self)
+        profile_action.setToolTip('Start (stop) sampling profiler.')
+        profile_action.triggered.connect(self.__profile_action_started)
+        profile_action.setShortcut('Ctrl+P')
+        self.profile_action = profile_action
+        self.addAction(self.profile_action)
+
+        if self.watchdog is not None:
+            self.watchdog.watch(MainWindow.WATCHDOG_LOOP_NAME)
+            self.heartbeat_ts = time.monotonic()
+            self.heartbeat_timer = QtCore.QTimer(self)
+            self.heartbeat_timer.timeout.connect(self.heartbeat)
+            self.heartbeat_timer.start(int(self.watchdog.interval_s * 1000))
+
         self.setCentralWidget(self.info_widget)
         self.show()
 
-    def __quit_action_started(self):
+    WATCHDOG_LOOP_NAME = 'qt'
+
+    def heartbeat(self):
+        now = time.monotonic()
+        self.watchdog.beat(MainWindow.WATCHDOG_LOOP_NAME, max(0.0, now - self.heartbeat_ts - self.watchdog.interval_s))
+        self.heartbeat_ts = now
+
+    def __profile_action_started(self):
+        if self.profiler.is_running():
+            self.profiler.stop()
+            self.statusBar().showMessage('profiler is stopped')
+            return
+        fname = self.profiler.start(self.profile_duration_s)
+        self.statusBar().showMessage('profiling for %d seconds to "%s"' % (self.profile_duration_s, fname))
+
+    def icon(self, *path) -> QIcon:
+        """Returns cached icon; QIcon reads image file only when icon is painted for the first time."""
+        icon = self.icons.get(path)
+        if icon is None:
+            icon = QIcon(os.path.join(self.static_path, *path))
+            self.icons[path] = icon
+        return icon
+
+    def get_network_manager(self) -> QtNetwork.QNetworkAccessManager:
+        if self.network_manager is None:
+            self.network_manager = QtNetwork.QNetworkAccessManager()
+            self.network_manager.finished.connect(self.handle_response)
+        return self.network_manager
+
+    def get_encode_pool(self) -> concurrent.futures.ThreadPoolExecutor:
+        if self.encode_pool is None:
+            self.encode_pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.find_cfg.encode_workers)
+        return self.encode_pool
+
+    def has_active_reviews(self) -> bool:
         if len(self.sub_windows) != 0:
+            return True
+        for bw in self.batch_windows:
+            if bw.has_pending():
+                return True
+        return False
+
+    def get_export_worker(self) -> ExportWorker:
+        if self.export_worker is None:
+            self.export_worker = ExportWorker(self.export_cfg.keep_original)
+            self.export_worker.signals.progress.connect(self.on_export_progress)
+            self.export_worker.signals.finished.connect(self.on_export_finished)
+            self.export_worker.start()
+        return self.export_worker
+
+    def __quit_action_started(self):
+        if self.has_active_reviews():
             warn = QMessageBox()
             warn.setStandardButtons(QMessageBox.Ok)
             warn.setFont(QFont("DejaVu Sans Mono", 12, QtGui.QFont.PreferDefault))
@@ -246,25 +1058,22 @@ class MainWindow(QMainWindow):
     REQ_API_V1_PUT_IMAGE = '/api/v1/put_image'
 
     def __find_action_started(self):
-        fname = QFileDialog.getOpenFileName(self, 'Choose image', str(Path.home()))[0]
-        if not os.path.isfile(fname):
+        fnames = QFileDialog.getOpenFileNames(self, 'Choose images', str(Path.home()))[0]
+        fnames = [fname for fname in fnames if os.path.isfile(fname)]
+        if len(fnames) == 0:
             warn = QMessageBox()
             warn.setStandardButtons(QMessageBox.Ok)
             warn.setFont(QFont("DejaVu Sans Mono", 12, QtGui.QFont.PreferDefault))
             warn.setText("""You should choose image.""")
             warn.exec_()
             return
+        if len(fnames) > 1:
+            self.start_find_batch('Find: %d images' % len(fnames), fnames)
+            return
+        fname = fnames[0]
 
-        url = self.facedb_addr + MainWindow.REQ_API_V1_PUT_IMAGE
-        req = QtNetwork.QNetworkRequest(QtCore.QUrl(url))
-        req.setHeader(QtNetwork.QNetworkRequest.ContentTypeHeader,
-                      'application/json')
         try:
-            img = Image.open(fname)
-            bytes_io = BytesIO()
-            img.save(bytes_io, format='PNG')
-            img_buff = str(b64encode(bytes_io.getvalue()))
-            img_buff = img_buff[2:len(img_buff) - 1]
+            img_buff = encode_image_file(fname)
         except Exception:
             warn = QMessageBox()
             warn.setStandardButtons(QMessageBox.Ok)
@@ -278,13 +1087,86 @@ class MainWindow(QMainWindow):
             'ts': datetime.datetime.now(),
             'fname': fname
         }
+        self.scheduler.expect(find_face_id, PriorityScheduler.CLASS_FIND)
+        reply = self.put_image(find_face_id, img_buff)
+        self.find_replies[reply] = find_face_id
+
+    def __find_dir_action_started(self):
+        dname = QFileDialog.getExistingDirectory(self, 'Choose dir', str(Path.home()))
+        if not os.path.isdir(dname):
+            warn = QMessageBox()
+            warn.setStandardButtons(QMessageBox.Ok)
+            warn.setFont(QFont("DejaVu Sans Mono", 12, QtGui.QFont.PreferDefault))
+            warn.setText("""You should choose dir.""")
+            warn.exec_()
+            return
+        fnames = sorted(os.path.join(dname, fname) for fname in os.listdir(dname)
+                        if os.path.isfile(os.path.join(dname, fname)))
+        self.start_find_batch('Find: "%s"' % dname, fnames)
+
+    def __find_video_action_started(self):
+        fname = QFileDialog.getOpenFileName(self, 'Choose video', str(Path.home()),
+                                            'Videos (*.mp4 *.avi *.mkv *.mov *.webm);;All files (*)')[0]
+        if not os.path.isfile(fname):
+            warn = QMessageBox()
+            warn.setStandardButtons(QMessageBox.Ok)
+            warn.setFont(QFont("DejaVu Sans Mono", 12, QtGui.QFont.PreferDefault))
+            warn.setText("""You should choose video.""")
+            warn.exec_()
+            return
+        try:
+            import cv2
+        except ImportError:
+            warn = QMessageBox()
+            warn.setStandardButtons(QMessageBox.Ok)
+            warn.setFont(QFont("DejaVu Sans Mono", 12, QtGui.QFont.PreferDefault))
+            warn.setText("""Find in video requires OpenCV.<br>
+            Install "opencv-python" package.""")
+            warn.exec_()
+            return
+        cap = cv2.VideoCapture(fname)
+        opened = cap.isOpened()
+        cap.release()
+        if not opened:
+            warn = QMessageBox()
+            warn.setStandardButtons(QMessageBox.Ok)
+            warn.setFont(QFont("DejaVu Sans Mono", 12, QtGui.QFont.PreferDefault))
+            warn.setText("""Chosen file is not a video. Dropping request.""")
+            warn.exec_()
+            return
+        sampler = VideoFrameSampler(fname, self.find_cfg)
+        bw = FindBatchWindow('Find: video "%s"' % fname, sampler, self.find_cfg.max_in_flight,
+                             self.find_cfg.max_unreviewed, self.get_encode_pool(), self, 'frame time')
+        sampler.on_sampled = bw.jobs_ready.emit
+        self.batch_windows.append(bw)
+        bw.show()
+        sampler.start()
+        bw.start()
+
+    def start_find_batch(self, title: str, fnames: list):
+        jobs = ((fname, functools.partial(encode_image_file, fname)) for fname in fnames)
+        bw = FindBatchWindow(title, jobs, self.find_cfg.max_in_flight, self.find_cfg.max_unreviewed,
+                             self.get_encode_pool(), self)
+        self.batch_windows.append(bw)
+        bw.show()
+        bw.start()
+
+    def put_image(self, req_uuid: str, img_buff: str) -> QtNetwork.QNetworkReply:
+        """Sends image to FaceDB.
+
+        Qt doesn't pipeline PUT requests, concurrent requests go through network manager's connections pool.
+        """
+        url = self.facedb_addr + MainWindow.REQ_API_V1_PUT_IMAGE
+        req = QtNetwork.QNetworkRequest(QtCore.QUrl(url))
+        req.setHeader(QtNetwork.QNetworkRequest.ContentTypeHeader,
+                      'application/json')
         json_data = {
-            'header': {'src_addr': self.src_addr, 'uuid': find_face_id},
+            'header': {'src_addr': self.src_addr, 'uuid': req_uuid},
             'img_buff': img_buff,
         }
         req_data = QtCore.QByteArray()
         req_data.append(json.dumps(json_data, ensure_ascii=False))
-        self.network_manager.put(req, req_data)
+        return self.get_network_manager().put(req, req_data)
 
     REQ_API_V1_ADD_CONTROL_OBJECT = '/api/v1/add_control_object'
 
@@ -325,11 +1207,7 @@ class MainWindow(QMainWindow):
         img_buffs = []
         for img_name in imgs_names:
             try:
-                img = Image.open(img_name)
-                bytes_io = BytesIO()
-                img.save(bytes_io, format='PNG')
-                img_buff = str(b64encode(bytes_io.getvalue()))
-                img_buff = img_buff[2:len(img_buff) - 1]
+                img_buff = encode_image_file(img_name)
             except Exception:
                 warn = QMessageBox()
                 warn.setStandardButtons(QMessageBox.Ok)
@@ -344,6 +1222,7 @@ class MainWindow(QMainWindow):
             'ts': datetime.datetime.now(),
             'dname': dname
         }
+        self.scheduler.expect(add_face_uuid, PriorityScheduler.CLASS_FIND)
 
         # Send JSON data.
 
@@ -363,7 +1242,7 @@ class MainWindow(QMainWindow):
         }
         req_data = QtCore.QByteArray()
         req_data.append(json.dumps(json_data, ensure_ascii=False))
-        self.network_manager.post(req, req_data)
+        self.get_network_manager().post(req, req_data)
 
         # Send all images.
         for i in range(len(img_buffs)):
@@ -381,17 +1260,80 @@ class MainWindow(QMainWindow):
             }
             req_data = QtCore.QByteArray()
             req_data.append(json.dumps(json_data, ensure_ascii=False))
-            self.network_manager.post(req, req_data)
+            self.get_network_manager().post(req, req_data)
+
+    def __history_action_started(self):
+        if self.history_window is None:
+            self.history_window = HistoryWindow(self.history, self.history_cfg.search_limit)
+        self.history_window.show()
+        self.history_window.activateWindow()
+
+    def __export_action_started(self):
+        fname = QFileDialog.getSaveFileName(self, 'Export reviews', str(Path.home()),
+                                            'Archives (*.tar *.zip)')[0]
+        if fname == '':
+            return
+        reviews = [nw.review(NotificationWindow.STATUS_PENDING) for nw in self.sub_windows.values()]
+        reviews.extend(self.decided_reviews)
+        if len(reviews) == 0:
+            warn = QMessageBox()
+            warn.setStandardButtons(QMessageBox.Ok)
+            warn.setFont(QFont("DejaVu Sans Mono", 12, QtGui.QFont.PreferDefault))
+            warn.setText("""There are no reviews to export.""")
+            warn.exec_()
+            return
+        self.get_export_worker().export_reviews(fname, reviews)
+
+    def on_export_progress(self, name: str, done: int, total: int):
+        self.statusBar().showMessage('%s: %d/%d' % (name, done, total))
+
+    def on_export_finished(self, name: str, error: str):
+        if error == '':
+            self.statusBar().showMessage('%s: done' % name)
+            return
+        self.statusBar().showMessage('%s: failed' % name)
+        warn = QMessageBox()
+        warn.setStandardButtons(QMessageBox.Ok)
+        warn.setFont(QFont("DejaVu Sans Mono", 12, QtGui.QFont.PreferDefault))
+        warn.setText('Unable to %s: %s' % (name, error))
+        warn.exec_()
+
+    def record_decision(self, nw, command: str):
+        review = nw.review(command)
+        self.keep_decided_review(review)
+        if self.history is not None:
+            self.history.record(review)
+        self.sub_windows.pop(nw.ts)
+        batch = self.batch_reviews.pop(nw.uuid, None)
+        if batch is not None:
+            batch[0].on_decided(batch[1], command)
+
+    def keep_decided_review(self, review: dict):
+        """Keeps review for batch export, the oldest reviews are dropped over count and size limits."""
+        self.decided_reviews.append(review)
+        self.decided_bytes += len(review['img_bytes'])
+        while len(self.decided_reviews) > 1 and \
+                (len(self.decided_reviews) > self.export_cfg.max_decided_reviews or
+                 (self.export_cfg.max_decided_bytes > 0 and self.decided_bytes > self.export_cfg.max_decided_bytes)):
+            self.decided_bytes -= len(self.decided_reviews.popleft()['img_bytes'])
 
     def handle_response(self, reply: QtNetwork.QNetworkReply):
         er = reply.error()
-        if er == QtNetwork.QNetworkReply.NoError:
+        batch = self.pending_replies.pop(reply, None)
+        find_face_id = self.find_replies.pop(reply, None)
+        if batch is not None:
+            batch[0].on_sent(batch[1], er == QtNetwork.QNetworkReply.NoError)
+        elif er == QtNetwork.QNetworkReply.NoError:
             print('ok')
         else:
             print('error')
+            if find_face_id is not None:
+                self.awaiting_controls.pop(find_face_id, None)
+                self.scheduler.forget(find_face_id)
+        reply.deleteLater()
 
     def closeEvent(self, event):
-        if len(self.sub_windows) != 0:
+        if self.has_active_reviews():
             warn = QMessageBox()
             warn.setStandardButtons(QMessageBox.Ok)
             warn.setFont(QFont("DejaVu Sans Mono", 12, QtGui.QFont.PreferDefault))
@@ -403,7 +1345,7 @@ class MainWindow(QMainWindow):
             self.app.exit()
 
     def user_trigger_cb(self):
-        p = self.mq.sync_q.get()
+        p = self.scheduler.get()
         if p[0] == 'notify_control':
             self.on_notify_control(p)
         elif p[0] == 'notify_add_control_object':
@@ -413,6 +1355,19 @@ class MainWindow(QMainWindow):
         msg = p[1]
         outmq = p[2]
 
+        req_uuid = msg.get('header').get('uuid')
+
+        if self.awaiting_controls.get(req_uuid) is not None:
+            aw_control = self.awaiting_controls.pop(req_uuid)
+            if aw_control.get('batch') is not None:
+                aw_control['batch'].on_result(aw_control['index'], msg, outmq)
+                return
+            win_name = '"%s" in %s' % (aw_control['fname'], (datetime.datetime.now() - aw_control['ts']))
+        else:
+            win_name = 'Unknown new image'
+        self.open_notification_window(win_name, msg, outmq)
+
+    def open_notification_window(self, win_name: str, msg: dict, outmq: janus.Queue):
         header = msg.get('header')
 
         req_uuid = header.get('uuid')
@@ -426,14 +1381,9 @@ class MainWindow(QMainWindow):
         pix_map.loadFromData(img_buff.getvalue())
 
         image_control_objects = msg.get('image_control_objects')
-        if self.awaiting_controls.get(req_uuid) is not None:
-            aw_control = self.awaiting_controls.pop(req_uuid)
-            win_name = '"%s" in %s' % (aw_control['fname'], (datetime.datetime.now() - aw_control['ts']))
-        else:
-            win_name = 'Unknown new image'
-        cur_time = clock()
-        nw = NotificationWindow(self.src_addr, win_name, header, req_uuid, pix_map, image_control_objects, outmq, cur_time,
-                                self)
+        cur_time = time.perf_counter()
+        nw = NotificationWindow(self.src_addr, win_name, header, req_uuid, pix_map, img_buff.getvalue(),
+                                image_control_objects, outmq, cur_time, self)
         self.sub_windows[cur_time] = nw
         nw.show()
 
@@ -450,15 +1400,252 @@ class MainWindow(QMainWindow):
             notify.setText('Unknown "AddControlObject" request was processed')
         notify.exec_()
 
+class FindBatchWindow(QWidget):
+    """FindBatchWindow class sends several images to FaceDB and shows all their results in one table.
+
+    Images are encoded in worker pool; at most max_in_flight images are being encoded or sent at once,
+    so only a few encoded images are kept in memory. Double click on result opens it for review.
+    Results wait for operator's review, so no new images are sent, while max_unreviewed images are queued,
+    sent or wait for review, and memory and pending reviews don't grow with number of images.
+    """
+
+    COLUMNS = ('image', 'status', 'faces', 'control objects')
+
+    STATUS_QUEUED = 'queued'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_READY = 'ready'
+    STATUS_REVIEWING = 'reviewing'
+    STATUS_PROCESS_AGAIN = 'process_again'
+    STATUS_CANCELLED = 'cancel'
+    # statuses of images, that are not decided yet.
+    UNREVIEWED = (STATUS_QUEUED, STATUS_SENT, STATUS_READY, STATUS_REVIEWING, STATUS_PROCESS_AGAIN)
+
+    # (image index, base64 encoded image, error text)
+    encoded = pyqtSignal(int, str, str)
+    # is emitted from any thread, when jobs iterable has new jobs.
+    jobs_ready = pyqtSignal()
+
+    def __init__(self, title: str, jobs, max_in_flight: int, max_unreviewed: int, pool: concurrent.futures.Executor,
+                 parent: MainWindow, label_name: str = 'image'):
+        """jobs is iterable of (label, callable, returning base64 encoded image) tuples.
+
+        Iterable may return None, if next job is not ready yet, and emit jobs_ready later.
+        """
+        super().__init__()
+        self.title = title
+        self.label_name = label_name
+        self.jobs = iter(jobs)
+        self.exhausted = False
+        # closed window doesn't send new images and cancels results, that come after it is closed.
+        self.closed = False
+        self.max_in_flight = max_in_flight
+        self.max_unreviewed = max_unreviewed
+        self.in_flight = 0
+        self.pool = pool
+        self.parent = parent
+        self.items = []
+        self.encoded.connect(self.on_encoded)
+        self.jobs_ready.connect(self.fill)
+        self.__init_find_batch_window()
+
+    def __init_find_batch_window(self):
+        self.setFont(QFont("DejaVu Sans Mono", 12, QtGui.QFont.PreferDefault))
+        self.setWindowTitle(self.title)
+
+        self.grid = QGridLayout()
+        self.setLayout(self.grid)
+
+        self.results = QTableWidget(0, len(FindBatchWindow.COLUMNS))
+        self.results.setHorizontalHeaderLabels((self.label_name,) + FindBatchWindow.COLUMNS[1:])
+        self.results.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.results.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.results.cellDoubleClicked.connect(self.open_review)
+        self.grid.addWidget(self.results, 0, 0, 1, 2)
+
+        self.status = QLabel()
+        self.grid.addWidget(self.status, 1, 0)
+
+        self.cancel_btn = QPushButton('cancel remaining', self)
+        self.cancel_btn.setToolTip("""'cancel remaining' button drops all results, that were not reviewed,<br>
+        and images, that were not sent yet. You can't undo it.""")
+        self.cancel_btn.clicked.connect(self.cancel_btn_clicked)
+        self.grid.addWidget(self.cancel_btn, 1, 1)
+
+    def start(self):
+        self.fill()
+
+    def fill(self):
+        unreviewed = sum(1 for item in self.items if item['status'] in FindBatchWindow.UNREVIEWED)
+        while self.in_flight < self.max_in_flight and not self.exhausted and \
+                (self.max_unreviewed <= 0 or unreviewed < self.max_unreviewed):
+            try:
+                job = next(self.jobs)
+            except StopIteration:
+                self.exhausted = True
+                break
+            if job is None:
+                break
+            label, job = job
+            index = len(self.items)
+            self.items.append({'label': label, 'uuid': str(uuid.uuid4()), 'status': FindBatchWindow.STATUS_QUEUED,
+                               'ts': datetime.datetime.now(), 'msg': None, 'outmq': None, 'faces': '', 'names': ''})
+            self.results.insertRow(index)
+            self.update_row(index)
+            self.in_flight += 1
+            unreviewed += 1
+            future = self.pool.submit(job)
+            future.add_done_callback(functools.partial(self.__emit_encoded, index))
+        self.update_status()
+
+    def __emit_encoded(self, index: int, future: concurrent.futures.Future):
+        # Is called from worker thread, signal passes result to GUI thread.
+        try:
+            self.encoded.emit(index, future.result(), '')
+        except Exception as e:
+            self.encoded.emit(index, '', str(e) or 'unable to encode image')
+
+    def on_encoded(self, index: int, img_buff: str, error: str):
+        item = self.items[index]
+        if self.closed:
+            item['status'] = FindBatchWindow.STATUS_CANCELLED
+            self.in_flight -= 1
+            return
+        if error != '':
+            self.on_sent(index, False)
+            return
+        self.parent.awaiting_controls[item['uuid']] = {
+            'ts': item['ts'],
+            'fname': item['label'],
+            'batch': self,
+            'index': index
+        }
+        self.parent.scheduler.expect(item['uuid'], PriorityScheduler.CLASS_FIND)
+        reply = self.parent.put_image(item['uuid'], img_buff)
+        self.parent.pending_replies[reply] = (self, index)
+        item['status'] = FindBatchWindow.STATUS_SENT
+        self.update_row(index)
+
+    def on_sent(self, index: int, ok: bool):
+        item = self.items[index]
+        if not ok:
+            self.parent.awaiting_controls.pop(item['uuid'], None)
+            self.parent.scheduler.forget(item['uuid'])
+            item['status'] = FindBatchWindow.STATUS_FAILED
+            self.update_row(index)
+        self.in_flight -= 1
+        self.fill()
+
+    def on_result(self, index: int, msg: dict, outmq: janus.Queue):
+        item = self.items[index]
+        image_control_objects = msg.get('image_control_objects') or []
+        item['faces'] = str(len(image_control_objects))
+        item['names'] = ', '.join('%s %s' % (ico['control_object'].get('surname', '-'),
+                                             ico['control_object'].get('name', '-'))
+                                  for ico in image_control_objects)
+        item['msg'] = msg
+        item['outmq'] = outmq
+        item['status'] = FindBatchWindow.STATUS_READY
+        if self.closed:
+            self.cancel_item(index)
+            return
+        self.update_row(index)
+        self.update_status()
+
+    def on_decided(self, index: int, command: str):
+        item = self.items[index]
+        item['msg'] = None
+        item['outmq'] = None
+        if command == FindBatchWindow.STATUS_PROCESS_AGAIN:
+            # Result of the next recognition comes back to this batch.
+            self.parent.awaiting_controls[item['uuid']] = {
+                'ts': datetime.datetime.now(),
+                'fname': item['label'],
+                'batch': self,
+                'index': index
+            }
+        item['status'] = command
+        self.update_row(index)
+        # Reviewed result makes room for the next image.
+        self.fill()
+
+    def open_review(self, row: int, column: int):
+        item = self.items[row]
+        if item['status'] != FindBatchWindow.STATUS_READY:
+            return
+        win_name = '"%s" in %s' % (item['label'], (datetime.datetime.now() - item['ts']))
+        self.parent.batch_reviews[item['uuid']] = (self, row)
+        self.parent.open_notification_window(win_name, item['msg'], item['outmq'])
+        item['status'] = FindBatchWindow.STATUS_REVIEWING
+        self.update_row(row)
+
+    def stop_jobs(self):
+        """Drops jobs, that are not started yet."""
+        self.exhausted = True
+        if hasattr(self.jobs, 'close'):
+            self.jobs.close()
+
+    def cancel_btn_clicked(self):
+        self.stop_jobs()
+        for index in range(len(self.items)):
+            if self.items[index]['status'] == FindBatchWindow.STATUS_READY:
+                self.cancel_item(index)
+
+    def cancel_item(self, index: int):
+        item = self.items[index]
+        msg = {
+            'header': {'src_addr': self.parent.src_addr, 'uuid': item['uuid']},
+            'command': FindBatchWindow.STATUS_CANCELLED,
+        }
+        item['outmq'].sync_q.put((item['msg']['header']['src_addr'], msg))
+        self.on_decided(index, FindBatchWindow.STATUS_CANCELLED)
+
+    def has_pending(self) -> bool:
+        for item in self.items:
+            if item['status'] == FindBatchWindow.STATUS_READY:
+                return True
+        return False
+
+    def update_row(self, index: int):
+        item = self.items[index]
+        values = (item['label'], item['status'], item['faces'], item['names'])
+        for j in range(len(values)):
+            self.results.setItem(index, j, QTableWidgetItem(values[j]))
+
+    def update_status(self):
+        counts = collections.Counter(item['status'] for item in self.items)
+        self.status.setText(', '.join('%s: %d' % (status, count) for status, count in sorted(counts.items())))
+
+    def closeEvent(self, event):
+        if self.has_pending():
+            warn = QMessageBox()
+            warn.setStandardButtons(QMessageBox.Ok)
+            warn.setFont(QFont("DejaVu Sans Mono", 12, QtGui.QFont.PreferDefault))
+            warn.setText("""You can't close window without reviewing<br>
+            or cancelling all results.""")
+            warn.exec_()
+            event.ignore()
+        else:
+            # Results of images, that are already sent, are cancelled, when they come.
+            self.stop_jobs()
+            self.closed = True
+            if self in self.parent.batch_windows:
+                self.parent.batch_windows.remove(self)
+            event.accept()
+
+
 class NotificationWindow(QWidget):
-    def __init__(self, src_addr, win_name: str, header, uuid, pix_map: QPixmap, image_control_objects,
-                 outmq: janus.Queue, ts: float, parent: MainWindow):
+    STATUS_PENDING = 'pending'
+
+    def __init__(self, src_addr, win_name: str, header, uuid, pix_map: QPixmap, img_bytes: bytes,
+                 image_control_objects, outmq: janus.Queue, ts: float, parent: MainWindow):
         super().__init__()
         self.src_addr = src_addr
         self.win_name = win_name
         self.header = header
         self.uuid = uuid
         self.pix_map = pix_map
+        self.img_bytes = img_bytes
         self.image_control_objects = image_control_objects
         self.outmq = outmq
         self.ts = ts
@@ -501,7 +1688,7 @@ class NotificationWindow(QWidget):
 
         self.save_data_btn = PushButtonOnce('save data', self)
         self.save_data_btn.setToolTip("""'save data' button saves image and its faces data to selected path<br>
-        (image will be saved as '/path.png', faces data - as '/path.json'""")
+        (image will be saved as '/path/img.png', faces data - as '/path/faces.json'""")
         self.save_data_btn.clicked.connect(self.save_data_btn_clicked)
         self.grid.addWidget(self.save_data_btn, 3, 1)
 
@@ -518,14 +1705,21 @@ class NotificationWindow(QWidget):
             warn.setStandardButtons(QMessageBox.Ok)
             warn.setFont(QFont("DejaVu Sans Mono", 12, QtGui.QFont.PreferDefault))
             warn.setText("""Choose non-existing folder.""")
+            warn.exec_()
             return
-        os.mkdir(dname)
-        img_name = os.path.join(dname, 'img.png')
-        self.pix_map.save(img_name)
-        data_name = os.path.join(dname, 'faces.json')
-        with open(data_name, 'w') as out:
-            json.dump({'image_control_objects': self.image_control_objects}, out,
-                      ensure_ascii=False, indent=4, sort_keys=True)
+        if dname == '':
+            return
+        self.update_image_control_objects()
+        self.parent.get_export_worker().save_review(dname, self.review(NotificationWindow.STATUS_PENDING))
+
+    def review(self, status: str) -> dict:
+        return {
+            'uuid': self.uuid,
+            'win_name': self.win_name,
+            'status': status,
+            'image_control_objects': copy.deepcopy(self.image_control_objects),
+            'img_bytes': self.img_bytes
+        }
 
     def update_image_control_objects(self):
         for i in range(len(self.image_control_objects)):
@@ -554,7 +1748,7 @@ class NotificationWindow(QWidget):
             'image_control_objects': self.image_control_objects
         }
         self.outmq.sync_q.put((self.header['src_addr'], msg))
-        self.parent.sub_windows.pop(self.ts)
+        self.parent.record_decision(self, 'submit')
 
     def recognize_again_btn_clicked(self):
         self.recognize_again_btn.setChecked(True)
@@ -569,8 +1763,9 @@ class NotificationWindow(QWidget):
             'command': 'process_again',
             'image_control_objects': self.image_control_objects
         }
+        self.parent.scheduler.expect(self.uuid, PriorityScheduler.CLASS_PROCESS_AGAIN)
         self.outmq.sync_q.put((self.header['src_addr'], msg))
-        self.parent.sub_windows.pop(self.ts)
+        self.parent.record_decision(self, 'process_again')
 
     def cancel_btn_clicked(self):
         self.cancel_btn.setChecked(True)
@@ -584,7 +1779,7 @@ class NotificationWindow(QWidget):
             'command': 'cancel',
         }
         self.outmq.sync_q.put((self.header['src_addr'], msg))
-        self.parent.sub_windows.pop(self.ts)
+        self.parent.record_decision(self, 'cancel')
 
     def closeEvent(self, event):
         if self.submit_btn.first_time and \
@@ -710,21 +1905,20 @@ class InfoWidget(QWidget):
         super().__init__()
         self.logo_path = logo_path
         self.guide_text = guide_text
-        self.__init_main_widget(w_size)
+        self.w_size = w_size
+        self.__init_main_widget()
 
-    def __init_main_widget(self, w_size):
+    def __init_main_widget(self):
         self.grid = QGridLayout()
         self.setLayout(self.grid)
         positions = [(0, 0), (1, 0)]
 
         logo = QLabel()
         logo.setAlignment(Qt.AlignHCenter | Qt.AlignVCenter)
-        pix_map = QPixmap(self.logo_path)
-        sh = int(w_size[0] * 0.5)
-        pix_map.scaledToHeight(sh)
-        logo.setPixmap(pix_map)
         self.logo = logo
         self.grid.addWidget(self.logo, *positions[0])
+        # Logo is decoded after window is shown.
+        QtCore.QTimer.singleShot(0, self.load_logo)
 
         guide = QLabel()
         guide.setAlignment(Qt.AlignTop | Qt.AlignLeft)
@@ -734,10 +1928,117 @@ class InfoWidget(QWidget):
         self.guide = guide
         self.grid.addWidget(self.guide, *positions[1])
 
+    def load_logo(self):
+        pix_map = QPixmap(self.logo_path)
+        sh = int(self.w_size[0] * 0.5)
+        pix_map.scaledToHeight(sh)
+        self.logo.setPixmap(pix_map)
+
+
+class HistoryWindow(QWidget):
+    COLUMNS = ('ts', 'command', 'uuid', 'passport', 'surname', 'name', 'patronymic')
+
+    # hashes of image, chosen for search, are computed in separate thread.
+    image_hashed = pyqtSignal(tuple)
+
+    def __init__(self, history: HistoryStore, search_limit: int):
+        super().__init__()
+        self.history = history
+        self.search_limit = search_limit
+        self.image_hashed.connect(functools.partial(self.search, HistoryStore.FIELD_IMG_HASH))
+        self.__init_history_window()
+
+    def __init_history_window(self):
+        self.setFont(QFont("DejaVu Sans Mono", 12, QtGui.QFont.PreferDefault))
+        self.setWindowTitle('History')
+
+        self.grid = QGridLayout()
+        self.setLayout(self.grid)
+
+        self.field = QComboBox()
+        self.field.addItems([HistoryStore.FIELD_PASSPORT, HistoryStore.FIELD_SURNAME, HistoryStore.FIELD_UUID])
+        self.grid.addWidget(self.field, 0, 0)
+
+        self.query = QLineEdit()
+        self.query.returnPressed.connect(self.search_btn_clicked)
+        self.grid.addWidget(self.query, 0, 1)
+
+        self.search_btn = QPushButton('search', self)
+        self.search_btn.setToolTip("""'search' button finds reviews by passport, surname prefix or uuid.""")
+        self.search_btn.clicked.connect(self.search_btn_clicked)
+        self.grid.addWidget(self.search_btn, 0, 2)
+
+        self.search_image_btn = QPushButton('search image', self)
+        self.search_image_btn.setToolTip("""'search image' button finds reviews of the same image file.""")
+        self.search_image_btn.clicked.connect(self.search_image_btn_clicked)
+        self.grid.addWidget(self.search_image_btn, 0, 3)
+
+        self.results = QTableWidget(0, len(HistoryWindow.COLUMNS))
+        self.results.setHorizontalHeaderLabels(HistoryWindow.COLUMNS)
+        self.results.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.results.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.results.currentCellChanged.connect(self.show_thumbnail)
+        self.grid.addWidget(self.results, 1, 0, 1, 3)
+
+        self.thumbnail = QLabel()
+        self.thumbnail.setAlignment(Qt.AlignHCenter | Qt.AlignTop)
+        self.grid.addWidget(self.thumbnail, 1, 3)
+
+        self.status = QLabel()
+        self.grid.addWidget(self.status, 2, 0, 1, 4)
+
+    def search_btn_clicked(self):
+        self.search(self.field.currentText(), self.query.text().strip())
+
+    def search_image_btn_clicked(self):
+        fname = QFileDialog.getOpenFileName(self, 'Choose image', str(Path.home()))[0]
+        if not os.path.isfile(fname):
+            return
+        self.status.setText('hashing "%s"' % fname)
+        threading.Thread(target=self.hash_image, args=(fname,), name='history_hash', daemon=True).start()
+
+    def hash_image(self, fname: str):
+        """Emits hashes of file and of its PNG re-encoding: Find results are stored as FaceDB gets them from Find."""
+        with open(fname, 'rb') as f:
+            hashes = [HistoryStore.img_hash(f.read())]
+        try:
+            hashes.append(HistoryStore.img_hash(b64decode(encode_image_file(fname))))
+        except Exception:
+            pass
+        self.image_hashed.emit(tuple(hashes))
+
+    def search(self, field: str, value: str):
+        if value == '':
+            return
+        started_at = time.perf_counter()
+        rows = self.history.search(field, value, self.search_limit)
+        elapsed_ms = (time.perf_counter() - started_at) * 1000
+        self.results.setRowCount(len(rows))
+        for i in range(len(rows)):
+            review_id, ts, command = rows[i][0], rows[i][1], rows[i][2]
+            values = [datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S'), command]
+            values.extend('' if v is None else v for v in rows[i][3:])
+            for j in range(len(values)):
+                item = QTableWidgetItem(values[j])
+                item.setData(Qt.UserRole, review_id)
+                self.results.setItem(i, j, item)
+        self.thumbnail.clear()
+        self.status.setText('%d rows in %.1f ms' % (len(rows), elapsed_ms))
+
+    def show_thumbnail(self, row: int, column: int, prev_row: int, prev_column: int):
+        item = self.results.item(row, 0)
+        if item is None:
+            return
+        thumbnail = self.history.thumbnail(item.data(Qt.UserRole))
+        pix_map = QPixmap()
+        if thumbnail is not None:
+            pix_map.loadFromData(thumbnail)
+        self.thumbnail.setPixmap(pix_map)
+
 
 class GUI:
     APP_NAME = 'ControlPanel'
-    STATIC_PATH = '/home/mikhail/Python/controlpanel/static/'
+    STATIC_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'static')
     WIDTH_COEF = 0.5
     HEIGHT_COEF = 0.5
     GUIDE_TEXT = '''
@@ -754,19 +2055,25 @@ class GUI:
     Copyright (C) Mikhail Masyagin 2019
     '''
 
-    def __init__(self, mq: janus.Queue, src_addr: str, facedb_addr: str):
+    def __init__(self, scheduler: PriorityScheduler, src_addr: str, facedb_addr: str, export_cfg,
+                 watchdog: StallWatchdog, profiler: SamplingProfiler, profile_duration_s: float,
+                 history: HistoryStore, history_cfg, find_cfg):
         app = QApplication(sys.argv)
         self.app = app
-        self.mq = mq
-        self.main_window = MainWindow(self.app, self.mq, GUI.APP_NAME, GUI.STATIC_PATH,
-                                      GUI.WIDTH_COEF, GUI.HEIGHT_COEF, GUI.GUIDE_TEXT, src_addr, facedb_addr)
+        self.scheduler = scheduler
+        self.main_window = MainWindow(self.app, self.scheduler, GUI.APP_NAME, GUI.STATIC_PATH,
+                                      GUI.WIDTH_COEF, GUI.HEIGHT_COEF, GUI.GUIDE_TEXT, src_addr, facedb_addr,
+                                      export_cfg, watchdog, profiler, profile_duration_s, history, history_cfg,
+                                      find_cfg)
         self.facedb_addr = facedb_addr
         self.src_addr = src_addr
 
     def notify_gui(self):
         self.main_window.user_trigger.sig.emit()
 
-    def show(self):
+    def show(self, on_started=None):
+        if on_started is not None:
+            QtCore.QTimer.singleShot(0, on_started)
         self.app.exec_()
 
 
@@ -779,6 +2086,11 @@ class HTTPServerCFG:
         self.req_max_size = cfg['req_max_size']
         self.key_path = cfg['key_path']
         self.crt_path = cfg['crt_path']
+        self.event_loop = cfg.get('event_loop', 'asyncio')
+        self.backlog = cfg.get('backlog', 128)
+        self.keepalive_timeout_s = cfg.get('keepalive_timeout_s', 75)
+        self.reuse_port = cfg.get('reuse_port', False)
+        self.shutdown_timeout_s = cfg.get('shutdown_timeout_s', 10)
 
 
 class FaceDBCFG:
@@ -786,10 +2098,395 @@ class FaceDBCFG:
         self.addr = cfg['addr']
 
 
+class AutoDecisionCFG:
+    def __init__(self, cfg: dict):
+        self.enabled = cfg.get('enabled', False)
+        self.rules = cfg.get('rules', [])
+        self.headless_command = cfg.get('headless_command', 'cancel')
+        self.stats_interval_s = cfg.get('stats_interval_s', 0)
+
+
+class DispatcherCFG:
+    def __init__(self, cfg: dict):
+        self.addr = cfg.get('addr', '')
+        self.panels = cfg.get('panels', [])
+        self.health_check_interval_s = cfg.get('health_check_interval_s', 5)
+        self.timeout_ms = cfg.get('timeout_ms', 5000)
+        self.reroute_after_failures = cfg.get('reroute_after_failures', 3)
+
+
+class ExportCFG:
+    def __init__(self, cfg: dict):
+        self.keep_original = cfg.get('keep_original', False)
+        self.max_decided_reviews = cfg.get('max_decided_reviews', 1000)
+        self.max_decided_bytes = cfg.get('max_decided_bytes', 256 * 1024 * 1024)
+
+
+class SchedulerCFG:
+    def __init__(self, cfg: dict):
+        self.aging_s = cfg.get('aging_s', 30)
+        self.expected_ttl_s = cfg.get('expected_ttl_s', 3600)
+
+
+class AdmissionCFG:
+    def __init__(self, cfg: dict):
+        self.rate_per_s = cfg.get('rate_per_s', 0)
+        self.burst = cfg.get('burst', 20)
+        self.max_pending_reviews = cfg.get('max_pending_reviews', 0)
+        self.max_pending_bytes = cfg.get('max_pending_bytes', 0)
+        self.retry_after_s = cfg.get('retry_after_s', 5)
+
+
+class WatchdogCFG:
+    def __init__(self, cfg: dict):
+        self.enabled = cfg.get('enabled', True)
+        self.interval_ms = cfg.get('interval_ms', 100)
+        self.stall_threshold_ms = cfg.get('stall_threshold_ms', 500)
+
+
+class ProfilerCFG:
+    def __init__(self, cfg: dict):
+        self.interval_ms = cfg.get('interval_ms', 5)
+        self.duration_s = cfg.get('duration_s', 10)
+        self.out_dir = cfg.get('out_dir', '/tmp')
+
+
+class HistoryCFG:
+    def __init__(self, cfg: dict):
+        self.path = cfg.get('path', '')
+        self.max_rows = cfg.get('max_rows', 1000000)
+        self.max_age_days = cfg.get('max_age_days', 30)
+        self.thumbnail_size = cfg.get('thumbnail_size', 128)
+        self.search_limit = cfg.get('search_limit', 100)
+
+
+class FindCFG:
+    def __init__(self, cfg: dict):
+        self.max_in_flight = cfg.get('max_in_flight', 8)
+        self.encode_workers = cfg.get('encode_workers', 4)
+        self.max_unreviewed = cfg.get('max_unreviewed', 50)
+        self.video_frame_interval_s = cfg.get('video_frame_interval_s', 1)
+        self.video_scene_change_distance = cfg.get('video_scene_change_distance', 0)
+        self.video_scene_check_interval_s = cfg.get('video_scene_check_interval_s', 0.2)
+        self.video_queue_size = cfg.get('video_queue_size', 4)
+
+
+class DedupCFG:
+    def __init__(self, cfg: dict):
+        self.enabled = cfg.get('enabled', False)
+        self.max_distance = cfg.get('max_distance', 4)
+        self.window_s = cfg.get('window_s', 10)
+        self.mode = cfg.get('mode', 'answer')
+
+
 class CFG:
     def __init__(self, fcfg: dict):
         self.http_server_cfg = HTTPServerCFG(fcfg['http_server'])
         self.facedb_cfg = FaceDBCFG(fcfg['facedb'])
+        self.auto_decision_cfg = AutoDecisionCFG(fcfg.get('auto_decision', {}))
+        self.dispatcher_cfg = DispatcherCFG(fcfg.get('dispatcher', {}))
+        self.export_cfg = ExportCFG(fcfg.get('export', {}))
+        self.scheduler_cfg = SchedulerCFG(fcfg.get('scheduler', {}))
+        self.admission_cfg = AdmissionCFG(fcfg.get('admission', {}))
+        self.watchdog_cfg = WatchdogCFG(fcfg.get('watchdog', {}))
+        self.profiler_cfg = ProfilerCFG(fcfg.get('profiler', {}))
+        self.history_cfg = HistoryCFG(fcfg.get('history', {}))
+        self.find_cfg = FindCFG(fcfg.get('find', {}))
+        self.dedup_cfg = DedupCFG(fcfg.get('dedup', {}))
+
+
+class AutoDecisionPolicy:
+    """AutoDecisionPolicy class decides notifications, that don't need operator's review."""
+
+    COMMAND_SUBMIT = 'submit'
+    COMMAND_CANCEL = 'cancel'
+    COMMANDS = (COMMAND_SUBMIT, COMMAND_CANCEL)
+
+    CONDITION_NO_FACES = 'no_faces'
+    CONDITION_ALL_KNOWN = 'all_known'
+    CONDITION_MIN_SCORE = 'min_score'
+    CONDITIONS = (CONDITION_NO_FACES, CONDITION_ALL_KNOWN, CONDITION_MIN_SCORE)
+
+    UNKNOWN_ID = '-'
+
+    def __init__(self, cfg: AutoDecisionCFG, headless: bool):
+        self.cfg = cfg
+        self.headless = headless
+        for rule in self.cfg.rules:
+            if rule.get('condition') not in AutoDecisionPolicy.CONDITIONS:
+                raise ValueError('unknown auto decision condition "%s"' % rule.get('condition'))
+            if rule.get('command') not in AutoDecisionPolicy.COMMANDS:
+                raise ValueError('unknown auto decision command "%s"' % rule.get('command'))
+        if self.cfg.headless_command not in AutoDecisionPolicy.COMMANDS:
+            raise ValueError('unknown headless command "%s"' % self.cfg.headless_command)
+        self.counters = {
+            'total': 0,
+            AutoDecisionPolicy.COMMAND_SUBMIT: 0,
+            AutoDecisionPolicy.COMMAND_CANCEL: 0,
+            'manual': 0
+        }
+
+    def decide(self, image_control_objects: list):
+        """Returns command for notification or None, if operator should review it."""
+        self.counters['total'] += 1
+        command = None
+        if self.cfg.enabled:
+            for rule in self.cfg.rules:
+                if AutoDecisionPolicy.__matches(rule, image_control_objects):
+                    command = rule['command']
+                    break
+        if command is None and self.headless:
+            command = self.cfg.headless_command
+        if command is None:
+            self.counters['manual'] += 1
+        else:
+            self.counters[command] += 1
+        return command
+
+    @staticmethod
+    def __matches(rule: dict, image_control_objects: list) -> bool:
+        condition = rule['condition']
+        if condition == AutoDecisionPolicy.CONDITION_NO_FACES:
+            return len(image_control_objects) == 0
+        if len(image_control_objects) == 0:
+            return False
+        if condition == AutoDecisionPolicy.CONDITION_ALL_KNOWN:
+            for ico in image_control_objects:
+                cob_id = ico.get('control_object', {}).get('id', AutoDecisionPolicy.UNKNOWN_ID)
+                if cob_id in ('', AutoDecisionPolicy.UNKNOWN_ID):
+                    return False
+            return True
+        if condition == AutoDecisionPolicy.CONDITION_MIN_SCORE:
+            score_key = rule.get('score_key', 'score')
+            for ico in image_control_objects:
+                score = ico.get(score_key)
+                if score is None or score < rule.get('threshold', 1.0):
+                    return False
+            return True
+        return False
+
+    def stats(self) -> dict:
+        stats = dict(self.counters)
+        auto = stats[AutoDecisionPolicy.COMMAND_SUBMIT] + stats[AutoDecisionPolicy.COMMAND_CANCEL]
+        stats['auto_rate'] = auto / stats['total'] if stats['total'] != 0 else 0.0
+        return stats
+
+
+class AdmissionControl:
+    """AdmissionControl class limits notifications rate per source and number (and size) of pending reviews.
+
+    Review is pending from the moment it is accepted till the moment reply is sent.
+    All methods must be called from HTTP server's event loop.
+    """
+
+    def __init__(self, cfg: AdmissionCFG):
+        self.cfg = cfg
+        # buckets maps source (src_addr or remote address) to its tokens number and time of last update.
+        self.buckets = {}
+        self.swept_at = time.monotonic()
+        self.pending_reviews = 0
+        self.pending_bytes = 0
+        self.rejected_rate = 0
+        self.rejected_overload = 0
+
+    def reserve(self, size: int) -> float:
+        """Reserves slot for review of given size. Returns 0 or number of seconds to retry after.
+
+        Slot is taken at the same moment it is checked, so concurrent requests, that wait for their bodies,
+        can't pass the check together. Reserved slot must be released, even if request fails later.
+        """
+        if (self.cfg.max_pending_reviews > 0 and self.pending_reviews >= self.cfg.max_pending_reviews) or \
+                (self.cfg.max_pending_bytes > 0 and self.pending_bytes + size > self.cfg.max_pending_bytes):
+            self.rejected_overload += 1
+            return self.cfg.retry_after_s
+        self.pending_reviews += 1
+        self.pending_bytes += size
+        return 0
+
+    def check_rate(self, src_addr: str, remote: str = None) -> float:
+        """Takes token from buckets of src_addr and remote address. Returns 0 or number of seconds till the next token.
+
+        src_addr is taken from request body, so sender can change it, but can't change its remote address.
+        """
+        if self.cfg.rate_per_s <= 0:
+            return 0
+        now = time.monotonic()
+        self.sweep(now)
+        keys = [('src_addr', src_addr)]
+        if remote is not None:
+            keys.append(('remote', remote))
+        buckets = []
+        for key in keys:
+            tokens, ts = self.buckets.get(key, (self.cfg.burst, now))
+            buckets.append(min(self.cfg.burst, tokens + (now - ts) * self.cfg.rate_per_s))
+        if min(buckets) < 1:
+            for key, tokens in zip(keys, buckets):
+                self.buckets[key] = (tokens, now)
+            self.rejected_rate += 1
+            return (1 - min(buckets)) / self.cfg.rate_per_s
+        for key, tokens in zip(keys, buckets):
+            self.buckets[key] = (tokens - 1, now)
+        return 0
+
+    def sweep(self, now: float):
+        """Removes buckets, that are refilled, as they don't differ from new ones."""
+        refill_s = self.cfg.burst / self.cfg.rate_per_s
+        if now - self.swept_at < refill_s:
+            return
+        self.swept_at = now
+        for key in [key for key, (_, ts) in self.buckets.items() if now - ts >= refill_s]:
+            del self.buckets[key]
+
+    def resize(self, reserved: int, size: int):
+        """Corrects reserved size (taken from Content-Length) by real size of request."""
+        self.pending_bytes += size - reserved
+
+    def release(self, size: int):
+        self.pending_reviews -= 1
+        self.pending_bytes -= size
+
+    def stats(self) -> dict:
+        return {
+            'pending_reviews': self.pending_reviews,
+            'pending_bytes': self.pending_bytes,
+            'rate_buckets': len(self.buckets),
+            'rejected_rate': self.rejected_rate,
+            'rejected_overload': self.rejected_overload
+        }
+
+
+class DuplicateFilter:
+    """DuplicateFilter class finds near-duplicate notifications by perceptual hashes of their images.
+
+    Hashes of notifications from the last window_s seconds are indexed with multi-index hashing: hash is split to
+    max_distance + 1 bands and, by pigeonhole principle, hashes within max_distance differ in at most max_distance
+    bands, so at least one band is equal. Candidates with equal band are checked by exact Hamming distance.
+    Duplicate of pending review waits for its decision, duplicate of decided review is answered at once.
+    All methods must be called from HTTP server's event loop.
+    """
+
+    HASH_WIDTH = 8
+    HASH_HEIGHT = 8
+    HASH_BITS = HASH_WIDTH * HASH_HEIGHT
+
+    ACTION_NEW = 'new'
+    ACTION_MERGE = 'merge'
+    ACTION_ANSWER = 'answer'
+
+    MODE_MERGE = 'merge'
+    MODE_ANSWER = 'answer'
+    MODES = (MODE_MERGE, MODE_ANSWER)
+
+    def __init__(self, cfg: DedupCFG):
+        self.cfg = cfg
+        if self.cfg.mode not in DuplicateFilter.MODES:
+            raise ValueError('unknown deduplication mode "%s"' % self.cfg.mode)
+        if not 0 <= self.cfg.max_distance < DuplicateFilter.HASH_BITS:
+            raise ValueError('deduplication max_distance must be in [0, %d)' % DuplicateFilter.HASH_BITS)
+        bands_number = self.cfg.max_distance + 1
+        self.bands = []
+        shift = 0
+        for i in range(bands_number):
+            width = DuplicateFilter.HASH_BITS // bands_number + (1 if i < DuplicateFilter.HASH_BITS % bands_number else 0)
+            self.bands.append((shift, (1 << width) - 1))
+            shift += width
+        # tables map band's value to entries, entries are ordered by time to expire them from the left.
+        self.tables = [{} for _ in self.bands]
+        self.entries = collections.deque()
+        # pending maps uuid of review, that is not decided yet, to its entry.
+        self.pending = {}
+        self.counters = {'unique': 0, DuplicateFilter.ACTION_MERGE: 0, DuplicateFilter.ACTION_ANSWER: 0, 'hash_errors': 0}
+
+    def __keys(self, h: int):
+        return [(h >> shift) & mask for shift, mask in self.bands]
+
+    @staticmethod
+    def distance(h1: int, h2: int) -> int:
+        return bin(h1 ^ h2).count('1')
+
+    def expire(self, now: float):
+        while len(self.entries) != 0 and self.entries[0]['ts'] < now - self.cfg.window_s:
+            self.__remove(self.entries[0])
+
+    def find(self, h: int, now: float):
+        """Returns the closest entry within max_distance from h or None."""
+        self.expire(now)
+        best, best_distance = None, self.cfg.max_distance + 1
+        for table, key in zip(self.tables, self.__keys(h)):
+            for entry in table.get(key, ()):
+                d = DuplicateFilter.distance(h, entry['hash'])
+                if d < best_distance:
+                    best, best_distance = entry, d
+        return best
+
+    def __add(self, entry: dict):
+        entry['indexed'] = True
+        self.entries.append(entry)
+        for table, key in zip(self.tables, self.__keys(entry['hash'])):
+            table.setdefault(key, []).append(entry)
+
+    def __remove(self, entry: dict):
+        entry['indexed'] = False
+        self.entries.remove(entry)
+        for table, key in zip(self.tables, self.__keys(entry['hash'])):
+            candidates = table[key]
+            candidates.remove(entry)
+            if len(candidates) == 0:
+                del table[key]
+
+    def check(self, req_uuid: str, h: int):
+        """Returns action for notification and entry of its original (or of itself, if it is new)."""
+        now = time.monotonic()
+        original = self.find(h, now)
+        if original is not None and original['uuid'] != req_uuid:
+            if original['command'] is None:
+                self.counters[DuplicateFilter.ACTION_MERGE] += 1
+                return DuplicateFilter.ACTION_MERGE, original
+            if self.cfg.mode == DuplicateFilter.MODE_ANSWER:
+                self.counters[DuplicateFilter.ACTION_ANSWER] += 1
+                return DuplicateFilter.ACTION_ANSWER, original
+        self.counters['unique'] += 1
+        entry = {'uuid': req_uuid, 'hash': h, 'ts': now, 'command': None, 'image_control_objects': None,
+                 'duplicates': []}
+        self.__add(entry)
+        self.pending[req_uuid] = entry
+        return DuplicateFilter.ACTION_NEW, entry
+
+    def decided(self, entry: dict, msg: dict) -> list:
+        """Stores decision of review and returns its duplicates, that must be answered with the same decision.
+
+        Review, sent to recognition again, stays pending: its duplicates wait for the next decision.
+        """
+        if msg.get('command') not in AutoDecisionPolicy.COMMANDS:
+            return []
+        self.pending.pop(entry['uuid'], None)
+        entry['command'] = msg['command']
+        entry['image_control_objects'] = msg.get('image_control_objects')
+        duplicates = entry['duplicates']
+        entry['duplicates'] = []
+        if self.cfg.mode == DuplicateFilter.MODE_ANSWER:
+            # Decided review is kept for window_s seconds since decision.
+            if entry['indexed']:
+                self.__remove(entry)
+            entry['ts'] = time.monotonic()
+            self.__add(entry)
+        return duplicates
+
+    @staticmethod
+    def answer(entry: dict, src_addr: str, req_uuid: str) -> dict:
+        msg = {
+            'header': {'src_addr': src_addr, 'uuid': req_uuid},
+            'command': entry['command']
+        }
+        if entry['command'] == AutoDecisionPolicy.COMMAND_SUBMIT:
+            msg['image_control_objects'] = entry['image_control_objects']
+        return msg
+
+    def stats(self) -> dict:
+        stats = dict(self.counters)
+        stats['indexed'] = len(self.entries)
+        stats['pending'] = len(self.pending)
+        return stats
 
 
 class HTTPServer:
@@ -800,95 +2497,640 @@ class HTTPServer:
     UNABLE_TO_ENQUEUE = -3
     UNABLE_TO_SEND = -4
     INTERNAL_SERVER_ERROR = -5
+    READ_TIMEOUT = -6
+    RATE_LIMITED = -7
+    OVERLOADED = -8
 
     STATUS_BAD_REQUEST = 400
+    STATUS_REQUEST_TIMEOUT = 408
+    STATUS_TOO_MANY_REQUESTS = 429
     STATUS_INTERNAL_SERVER_ERROR = 500
+    STATUS_SERVICE_UNAVAILABLE = 503
 
     API_BASE = '/api/v1'
     API_NOTIFY_CONTROL = API_BASE + '/notify_control'
     API_NOTIFY_ADD_CONTROL_OBJECT = API_BASE + '/notify_add_control_object'
+    API_STATS = API_BASE + '/stats'
+    API_PROFILE = API_BASE + '/profile'
+
+    START_TIMEOUT_S = 5
 
-    def __init__(self, cfg: CFG, src_addr, loop: asyncio.BaseEventLoop, gui: GUI):
+    def __init__(self, cfg: CFG, src_addr, loop: asyncio.BaseEventLoop, scheduler: PriorityScheduler, headless: bool,
+                 profile: StartupProfile = None, watchdog: StallWatchdog = None, profiler: SamplingProfiler = None,
+                 history: HistoryStore = None):
         self.src_addr = src_addr
         self.cfg = cfg
         app = web.Application(client_max_size=self.cfg.http_server_cfg.req_max_size)
         app.add_routes([web.put(HTTPServer.API_NOTIFY_CONTROL, self.notify_control),
-                        web.put(HTTPServer.API_NOTIFY_ADD_CONTROL_OBJECT, self.notify_add_control_object)])
+                        web.put(HTTPServer.API_NOTIFY_ADD_CONTROL_OBJECT, self.notify_add_control_object),
+                        web.get(HTTPServer.API_STATS, self.get_stats),
+                        web.put(HTTPServer.API_PROFILE, self.start_profile)])
         self.app = app
 
         self.loop = loop
-        self.gui = gui
+        self.scheduler = scheduler
+        self.headless = headless
+        # GUI is attached after server is started, notifications are queued until then.
+        self.gui = None
+        self.gui_lock = threading.Lock()
+        self.started = threading.Event()
+        self.profile = profile if profile is not None else StartupProfile(False)
+        self.policy = AutoDecisionPolicy(self.cfg.auto_decision_cfg, self.headless)
+        self.admission = AdmissionControl(self.cfg.admission_cfg)
+        self.dedup = DuplicateFilter(self.cfg.dedup_cfg) if self.cfg.dedup_cfg.enabled else None
+        self.watchdog = watchdog
+        self.profiler = profiler
+        self.history = history
+        # background_tasks run until shutdown and are cancelled by it.
+        self.background_tasks = []
+        self.runner = None
+        self.session = None
+        # tasks are pending replies, that are drained on shutdown.
+        self.tasks = set()
+
+    def attach_gui(self, gui: GUI):
+        with self.gui_lock:
+            self.gui = gui
+            queued = self.scheduler.qsize()
+        # Called from GUI thread, where notify_gui runs its slot at once, and slot may block in modal dialog.
+        for _ in range(queued):
+            gui.notify_gui()
+
+    def pass_to_gui(self, p: tuple):
+        with self.gui_lock:
+            self.scheduler.put(p)
+            if self.gui is not None:
+                self.gui.notify_gui()
 
     def run(self):
+        bind_started_at = time.perf_counter()
         asyncio.set_event_loop(self.loop)
-        runner = self.app.make_handler()
+        http_server_cfg = self.cfg.http_server_cfg
 
-        if self.cfg.http_server_cfg.crt_path != '' and self.cfg.http_server_cfg.key_path != '':
+        if http_server_cfg.crt_path != '' and http_server_cfg.key_path != '':
             ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
-            ssl_context.load_cert_chain(self.cfg.http_server_cfg.crt_path,
-                                        self.cfg.http_server_cfg.key_path)
+            ssl_context.load_cert_chain(http_server_cfg.crt_path,
+                                        http_server_cfg.key_path)
         else:
             ssl_context = None
 
-        if ssl_context is not None:
-            srv = self.loop.create_server(runner,
-                                          host=self.cfg.http_server_cfg.addr,
-                                          port=self.cfg.http_server_cfg.port,
-                                          ssl=ssl_context)
+        runner_kwargs = {'keepalive_timeout': http_server_cfg.keepalive_timeout_s}
+        site_kwargs = {}
+        # aiohttp 3.9+ takes shutdown timeout by runner, site's argument is deprecated there.
+        if 'shutdown_timeout' in inspect.signature(web.BaseRunner.__init__).parameters:
+            runner_kwargs['shutdown_timeout'] = http_server_cfg.shutdown_timeout_s
         else:
-            srv = self.loop.create_server(runner,
-                                          host=self.cfg.http_server_cfg.addr,
-                                          port=self.cfg.http_server_cfg.port,
-                                          ssl=ssl_context)
-
-        self.loop.run_until_complete(srv)
+            site_kwargs['shutdown_timeout'] = http_server_cfg.shutdown_timeout_s
+        self.runner = web.AppRunner(self.app, **runner_kwargs)
+        self.loop.run_until_complete(self.runner.setup())
+        site = web.TCPSite(self.runner,
+                           host=http_server_cfg.addr,
+                           port=http_server_cfg.port,
+                           ssl_context=ssl_context,
+                           backlog=http_server_cfg.backlog,
+                           reuse_port=http_server_cfg.reuse_port or None,
+                           **site_kwargs)
+        self.loop.run_until_complete(site.start())
+        self.profile.add('http_server_bind', bind_started_at, time.perf_counter())
+        self.started.set()
+        if self.headless:
+            self.profile.report()
+        if threading.current_thread() is threading.main_thread():
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                try:
+                    self.loop.add_signal_handler(signum, self.loop.stop)
+                except NotImplementedError:
+                    pass
+        if self.watchdog is not None:
+            self.watchdog.watch(HTTPServer.WATCHDOG_LOOP_NAME)
+            self.start_background_task(self.heartbeat())
+        self.start_background_tasks()
         self.loop.run_forever()
+        self.loop.run_until_complete(self.shutdown())
+        self.loop.run_until_complete(self.loop.shutdown_asyncgens())
+        self.loop.close()
+
+    WATCHDOG_LOOP_NAME = 'asyncio'
+
+    async def heartbeat(self):
+        while True:
+            ts = self.loop.time()
+            await asyncio.sleep(self.watchdog.interval_s)
+            self.watchdog.beat(HTTPServer.WATCHDOG_LOOP_NAME,
+                               max(0.0, self.loop.time() - ts - self.watchdog.interval_s))
+
+    def stop(self):
+        """Stops server from any thread, run() returns after pending replies are drained."""
+        if not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+
+    async def shutdown(self):
+        if self.watchdog is not None:
+            self.watchdog.unwatch(HTTPServer.WATCHDOG_LOOP_NAME)
+        for task in self.background_tasks:
+            task.cancel()
+        if len(self.background_tasks) != 0:
+            await asyncio.wait(self.background_tasks)
+        if len(self.tasks) != 0:
+            _, pending = await asyncio.wait(list(self.tasks), timeout=self.cfg.http_server_cfg.shutdown_timeout_s)
+            # Replies, that were not sent in time, are dropped.
+            for task in pending:
+                task.cancel()
+            if len(pending) != 0:
+                await asyncio.wait(pending)
+        await self.runner.cleanup()
+        if self.session is not None:
+            await self.session.close()
+
+    def start_background_task(self, coro):
+        self.background_tasks.append(asyncio.ensure_future(coro, loop=self.loop))
+
+    def spawn(self, coro):
+        task = asyncio.ensure_future(coro, loop=self.loop)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def get_session(self):
+        """Returns client session, shared by all replies, so connections are reused."""
+        if self.session is None:
+            self.session = ClientSession(json_serialize=json.dumps,
+                                         timeout=ClientTimeout(total=self.cfg.http_server_cfg.write_timeout_ms / 1000))
+        return self.session
+
+    async def read_json(self, req: web.Request):
+        return await asyncio.wait_for(req.json(), self.cfg.http_server_cfg.read_timeout_ms / 1000)
+
+    def error_response(self, req_uuid: str, error_code: int, error_info: str, error_text: str,
+                       status: int, headers: dict = None) -> web.Response:
+        return web.json_response({
+            'headers': {'src_addr': self.src_addr, 'uuid': req_uuid},
+            'error_data': {
+                'error_code': error_code,
+                'error_info': error_info,
+                'error_text': error_text
+            }
+        }, status=status, headers=headers)
+
+    def rate_limited_response(self, req_uuid: str, retry_after_s: float) -> web.Response:
+        return self.error_response(req_uuid, HTTPServer.RATE_LIMITED, 'too many requests',
+                                   'requests rate limit for source address is exceeded',
+                                   HTTPServer.STATUS_TOO_MANY_REQUESTS,
+                                   {'Retry-After': str(int(math.ceil(retry_after_s)))})
+
+    def overloaded_response(self, req_uuid: str, retry_after_s: float) -> web.Response:
+        return self.error_response(req_uuid, HTTPServer.OVERLOADED, 'too many pending reviews',
+                                   'unable to accept request until pending reviews are processed',
+                                   HTTPServer.STATUS_SERVICE_UNAVAILABLE,
+                                   {'Retry-After': str(int(math.ceil(retry_after_s)))})
+
+    async def request_size(self, req: web.Request) -> int:
+        if req.content_length is not None:
+            return req.content_length
+        # Body is already read (and cached) at this point.
+        return len(await req.read())
+
+    def read_timeout_response(self, req_uuid: str) -> web.Response:
+        return self.error_response(req_uuid, HTTPServer.READ_TIMEOUT, 'request timeout',
+                                   'unable to read request body in time', HTTPServer.STATUS_REQUEST_TIMEOUT)
+
+    def start_background_tasks(self):
+        if self.cfg.auto_decision_cfg.stats_interval_s > 0:
+            self.start_background_task(self.print_stats(self.cfg.auto_decision_cfg.stats_interval_s))
+        if self.cfg.dispatcher_cfg.addr != '':
+            self.start_background_task(self.register_on_dispatcher())
+
+    REQ_API_V1_REGISTER_PANEL = '/api/v1/register_panel'
+
+    async def register_on_dispatcher(self):
+        """Registers panel on dispatcher. Registration is repeated, so restarted dispatcher finds panel again."""
+        msg = {'header': {'src_addr': self.src_addr, 'uuid': str(uuid.uuid4())}}
+        while True:
+            try:
+                async with self.get_session().put(self.cfg.dispatcher_cfg.addr + HTTPServer.REQ_API_V1_REGISTER_PANEL,
+                                                  json=msg):
+                    pass
+            except Exception as e:
+                print('unable to register on dispatcher "%s": %s' % (self.cfg.dispatcher_cfg.addr, e))
+            await asyncio.sleep(self.cfg.dispatcher_cfg.health_check_interval_s)
+
+    def stats(self) -> dict:
+        stats = {'auto_decision': self.policy.stats(), 'admission': self.admission.stats()}
+        if self.scheduler is not None:
+            stats['scheduler'] = self.scheduler.stats()
+        if self.watchdog is not None:
+            stats['watchdog'] = self.watchdog.stats()
+        if self.dedup is not None:
+            stats['dedup'] = self.dedup.stats()
+        return stats
+
+    async def print_stats(self, interval_s: float):
+        while True:
+            await asyncio.sleep(interval_s)
+            print(json.dumps(self.stats(), sort_keys=True))
+
+    async def get_stats(self, req: web.Request) -> web.Response:
+        return web.json_response({'headers': {'src_addr': self.src_addr, 'uuid': ''}, 'stats': self.stats()})
+
+    async def start_profile(self, req: web.Request) -> web.Response:
+        """Starts sampling profiler for "duration_s" (query parameter) seconds."""
+        try:
+            duration_s = float(req.query.get('duration_s', self.cfg.profiler_cfg.duration_s))
+        except ValueError:
+            return self.error_response('', HTTPServer.CORRUPTED_BODY_CODE, 'corrupted request',
+                                       'unable to read "duration_s" parameter', HTTPServer.STATUS_BAD_REQUEST)
+        fname = self.profiler.start(duration_s) if self.profiler is not None else ''
+        if fname == '':
+            return self.error_response('', HTTPServer.INTERNAL_SERVER_ERROR, 'profiler is busy',
+                                       'profiler is already running', HTTPServer.STATUS_SERVICE_UNAVAILABLE)
+        return web.json_response({'headers': {'src_addr': self.src_addr, 'uuid': ''}, 'profile': fname})
 
     RESP_API_V1_PUT_CONTROL = '/api/v1/put_control'
 
     async def notify_control(self, req: web.Request) -> web.Response:
         req_uuid = ''
+        # Request reserves slot by its Content-Length before body is read.
+        size = req.content_length or 0
+        retry_after_s = self.admission.reserve(size)
+        if retry_after_s > 0:
+            return self.overloaded_response(req_uuid, retry_after_s)
+        # Slot is released here, unless it is passed to the task, that sends reply.
+        reserved = True
+        try:
+            try:
+                body = await self.read_json(req)
+                header = body['header']
+                addr = header['src_addr']
+                req_uuid = header['uuid']
+                img_buff = body['img_buff']
+                # Null list of faces is treated as empty one by policy, deduplication, history and GUI.
+                image_control_objects = body['image_control_objects'] = body['image_control_objects'] or []
+            except asyncio.TimeoutError:
+                return self.read_timeout_response(req_uuid)
+            except KeyError:
+                return web.json_response({
+                    'headers': {'src_addr': self.src_addr, 'uuid': req_uuid},
+                    'error_data': {
+                        'error_code': HTTPServer.CORRUPTED_BODY_CODE,
+                        'error_info': 'corrupted request body',
+                        'error_text': 'unable to read request body'
+                    }
+                }, status=HTTPServer.STATUS_BAD_REQUEST)
+
+            retry_after_s = self.admission.check_rate(addr, req.remote)
+            if retry_after_s > 0:
+                return self.rate_limited_response(req_uuid, retry_after_s)
+            reserved_size = size
+            size = await self.request_size(req)
+            self.admission.resize(reserved_size, size)
+
+            # Results of operator's own requests are always shown to operator.
+            solicited = self.scheduler is not None and self.scheduler.is_expected(req_uuid)
+            command = self.policy.decide(image_control_objects) if not solicited else None
+            if command is not None:
+                msg = {
+                    'header': {'src_addr': self.src_addr, 'uuid': req_uuid},
+                    'command': command
+                }
+                if command == AutoDecisionPolicy.COMMAND_SUBMIT:
+                    msg['image_control_objects'] = image_control_objects
+                if self.history is not None:
+                    self.history.record({'uuid': req_uuid, 'status': command,
+                                         'image_control_objects': image_control_objects, 'img_buff': img_buff})
+                self.spawn(self.auto_decision_create_resp(addr, msg, size))
+                reserved = False
+                return web.json_response({'headers': {'src_addr': self.src_addr, 'uuid': req_uuid}})
+
+            entry = None
+            if self.dedup is not None:
+                # Review, sent to recognition again, comes back with the same uuid and keeps its entry.
+                entry = self.dedup.pending.get(req_uuid)
+                # Results of operator's own requests (e.g. frames of one video) are always shown.
+                if entry is None and not solicited:
+                    action, entry = await self.check_duplicate(req_uuid, img_buff)
+                    if action == DuplicateFilter.ACTION_MERGE:
+                        entry['duplicates'].append((addr, req_uuid, image_control_objects, img_buff, size))
+                        reserved = False
+                        return web.json_response({'headers': {'src_addr': self.src_addr, 'uuid': req_uuid}})
+                    if action == DuplicateFilter.ACTION_ANSWER:
+                        self.answer_duplicate(entry, (addr, req_uuid, image_control_objects, img_buff, size))
+                        reserved = False
+                        return web.json_response({'headers': {'src_addr': self.src_addr, 'uuid': req_uuid}})
+
+            msg = body
+            outmq = janus.Queue(loop=self.loop)
+            p = ('notify_control', msg, outmq)
+            self.pass_to_gui(p)
+
+            self.spawn(self.notify_control_create_resp(outmq, size, entry))
+            reserved = False
+            return web.json_response({'headers': {'src_addr': self.src_addr, 'uuid': req_uuid}})
+        finally:
+            if reserved:
+                self.admission.release(size)
+
+    async def check_duplicate(self, req_uuid: str, img_buff: str):
+        """Hashes image in executor, so neither event loop, nor GUI waits for decoding."""
+        try:
+            h = await self.loop.run_in_executor(None, image_dhash, img_buff)
+        except Exception as e:
+            print('unable to hash image of notification "%s": %s' % (req_uuid, e))
+            self.dedup.counters['hash_errors'] += 1
+            return DuplicateFilter.ACTION_NEW, None
+        return self.dedup.check(req_uuid, h)
+
+    def answer_duplicate(self, entry: dict, duplicate: tuple):
+        addr, req_uuid, image_control_objects, img_buff, size = duplicate
+        msg = DuplicateFilter.answer(entry, self.src_addr, req_uuid)
+        if self.history is not None:
+            self.history.record({'uuid': req_uuid, 'status': msg['command'],
+                                 'image_control_objects': image_control_objects, 'img_buff': img_buff})
+        self.spawn(self.auto_decision_create_resp(addr, msg, size))
+
+    async def auto_decision_create_resp(self, addr: str, msg: dict, size: int):
+        try:
+            await self.put_control(addr, msg)
+        finally:
+            self.admission.release(size)
+
+    async def notify_control_create_resp(self, outmq: janus.Queue, size: int, entry: dict = None):
+        try:
+            data = await outmq.async_q.get()
+            addr = data[0]
+            msg = data[1]
+            if entry is not None:
+                for duplicate in self.dedup.decided(entry, msg):
+                    self.answer_duplicate(entry, duplicate)
+            await self.put_control(addr, msg)
+        finally:
+            self.admission.release(size)
+
+    async def put_control(self, addr: str, msg: dict):
+        try:
+            async with self.get_session().put(addr + HTTPServer.RESP_API_V1_PUT_CONTROL, json=msg):
+                pass
+        except Exception as e:
+            print('unable to send reply "%s" to "%s": %s' % (msg['header']['uuid'], addr, e))
+
+    async def notify_add_control_object(self, req: web.Request) -> web.Response:
+        req_uuid = ''
+        # Slot is held only while body is read and passed on, as no reply is sent later.
+        size = req.content_length or 0
+        retry_after_s = self.admission.reserve(size)
+        if retry_after_s > 0:
+            return self.overloaded_response(req_uuid, retry_after_s)
+        try:
+            try:
+                body = await self.read_json(req)
+                header = body['header']
+                addr = header['src_addr']
+                req_uuid = header['uuid']
+            except asyncio.TimeoutError:
+                return self.read_timeout_response(req_uuid)
+            except KeyError:
+                return web.json_response({
+                    'headers': {'src_addr': self.src_addr, 'uuid': req_uuid},
+                    'error_data': {
+                        'error_code': HTTPServer.CORRUPTED_BODY_CODE,
+                        'error_info': 'corrupted request body',
+                        'error_text': 'unable to read request body'
+                    }
+                }, status=HTTPServer.STATUS_BAD_REQUEST)
+
+            retry_after_s = self.admission.check_rate(addr, req.remote)
+            if retry_after_s > 0:
+                return self.rate_limited_response(req_uuid, retry_after_s)
+
+            if self.headless:
+                print('"AddControlObject" request "%s" was processed' % req_uuid)
+                return web.json_response({'headers': {'src_addr': self.src_addr, 'uuid': req_uuid}})
+
+            msg = body
+            p = ('notify_add_control_object', msg)
+            self.pass_to_gui(p)
+
+            return web.json_response({'headers': {'src_addr': self.src_addr, 'uuid': req_uuid}})
+        finally:
+            self.admission.release(size)
+
+
+class Dispatcher(HTTPServer):
+    """Dispatcher class balances notifications between several ControlPanel instances.
+
+    Notifications are forwarded to the alive panel with the least number of pending reviews.
+    Dispatcher replaces "src_addr" with its own address, so panels' replies (and FaceDB's answers
+    to "process_again" commands) come back through dispatcher and are routed to the same panel.
+    """
+
+    API_PUT_CONTROL = HTTPServer.API_BASE + '/put_control'
+    API_REGISTER_PANEL = HTTPServer.API_BASE + '/register_panel'
+
+    COMMAND_PROCESS_AGAIN = 'process_again'
+
+    def __init__(self, cfg: CFG, src_addr, loop: asyncio.BaseEventLoop, profile: StartupProfile = None,
+                 watchdog: StallWatchdog = None, profiler: SamplingProfiler = None):
+        super().__init__(cfg, src_addr, loop, None, True, profile, watchdog, profiler)
+        self.app.router.add_put(Dispatcher.API_PUT_CONTROL, self.on_put_control)
+        self.app.router.add_put(Dispatcher.API_REGISTER_PANEL, self.register_panel)
+        # panels maps panel address to set of uuids of its pending reviews.
+        self.panels = {}
+        self.dead_panels = set()
+        # failures maps panel address to number of consecutive failed health checks.
+        self.failures = {}
+        for addr in self.cfg.dispatcher_cfg.panels:
+            self.panels[addr] = set()
+        # reviews maps uuid to panel address, FaceDB address and notification body.
+        # Body is None, when panel answered "process_again" and waits for FaceDB.
+        self.reviews = {}
+
+    def start_background_tasks(self):
+        self.start_background_task(self.check_panels())
+        if self.cfg.auto_decision_cfg.stats_interval_s > 0:
+            self.start_background_task(self.print_stats(self.cfg.auto_decision_cfg.stats_interval_s))
+
+    def stats(self) -> dict:
+        stats = {'dispatcher': {
+            'panels': {addr: {'pending': len(pending), 'alive': addr not in self.dead_panels}
+                       for addr, pending in self.panels.items()},
+            'reviews': len(self.reviews)
+        }, 'admission': self.admission.stats()}
+        if self.watchdog is not None:
+            stats['watchdog'] = self.watchdog.stats()
+        if self.dedup is not None:
+            stats['dedup'] = self.dedup.stats()
+        return stats
+
+    def get_timeout(self):
+        return ClientTimeout(total=self.cfg.dispatcher_cfg.timeout_ms / 1000)
+
+    def choose_panels(self, preferred: str) -> list:
+        """Returns alive panels in order of preference: sticky panel first, then the least loaded ones."""
+        alive = [addr for addr in self.panels if addr not in self.dead_panels]
+        alive.sort(key=lambda addr: len(self.panels[addr]))
+        if preferred in alive:
+            alive.remove(preferred)
+            alive.insert(0, preferred)
+        return alive
+
+    async def forward(self, api: str, body: dict, preferred: str = '') -> str:
+        """Sends body to the first panel, that accepts it. Returns its address or empty string."""
+        for addr in self.choose_panels(preferred):
+            try:
+                async with self.get_session().put(addr + api, json=body, timeout=self.get_timeout()) as resp:
+                    if resp.status == 200:
+                        return addr
+            except Exception as e:
+                print('panel "%s" is unavailable: %s' % (addr, e))
+                self.dead_panels.add(addr)
+        return ''
+
+    def unable_to_send_response(self, req_uuid: str) -> web.Response:
+        return self.error_response(req_uuid, HTTPServer.UNABLE_TO_SEND, 'no available panels',
+                                   'unable to send request to any panel', HTTPServer.STATUS_SERVICE_UNAVAILABLE)
+
+    async def dispatch_review(self, req_uuid: str, preferred: str = '') -> bool:
+        review = self.reviews[req_uuid]
+        addr = await self.forward(HTTPServer.API_NOTIFY_CONTROL, review['body'], preferred)
+        if addr == '':
+            return False
+        if self.reviews.get(req_uuid) is not review:
+            # Review was answered, while it was forwarded.
+            return True
+        review['panel'] = addr
+        self.panels[addr].add(req_uuid)
+        return True
+
+    async def notify_control(self, req: web.Request) -> web.Response:
+        req_uuid = ''
+        size = req.content_length or 0
+        retry_after_s = self.admission.reserve(size)
+        if retry_after_s > 0:
+            return self.overloaded_response(req_uuid, retry_after_s)
+        # Slot is released here, unless review is forwarded to panel and waits for its reply.
+        reserved = True
+        pending = None
+        try:
+            try:
+                body = await self.read_json(req)
+                header = body['header']
+                addr = header['src_addr']
+                req_uuid = header['uuid']
+                img_buff = body['img_buff']
+                image_control_objects = body['image_control_objects']
+            except asyncio.TimeoutError:
+                return self.read_timeout_response(req_uuid)
+            except KeyError:
+                return web.json_response({
+                    'headers': {'src_addr': self.src_addr, 'uuid': req_uuid},
+                    'error_data': {
+                        'error_code': HTTPServer.CORRUPTED_BODY_CODE,
+                        'error_info': 'corrupted request body',
+                        'error_text': 'unable to read request body'
+                    }
+                }, status=HTTPServer.STATUS_BAD_REQUEST)
+
+            retry_after_s = self.admission.check_rate(addr, req.remote)
+            if retry_after_s > 0:
+                return self.rate_limited_response(req_uuid, retry_after_s)
+            reserved_size = size
+            size = await self.request_size(req)
+            self.admission.resize(reserved_size, size)
+
+            preferred = ''
+            review = self.reviews.get(req_uuid)
+            if review is not None:
+                preferred = review['panel']
+                self.panels.get(preferred, set()).discard(req_uuid)
+                if review['body'] is not None:
+                    self.admission.release(review['size'])
+            header['src_addr'] = self.src_addr
+            pending = {'panel': '', 'facedb_addr': addr, 'body': body, 'size': size}
+            self.reviews[req_uuid] = pending
+
+            if not await self.dispatch_review(req_uuid, preferred):
+                return self.unable_to_send_response(req_uuid)
+            reserved = False
+            return web.json_response({'headers': {'src_addr': self.src_addr, 'uuid': req_uuid}})
+        finally:
+            # Review, that was replaced or answered meanwhile, has its slot already released.
+            if reserved and (pending is None or self.reviews.get(req_uuid) is pending):
+                self.reviews.pop(req_uuid, None)
+                self.admission.release(size)
+
+    async def notify_add_control_object(self, req: web.Request) -> web.Response:
+        req_uuid = ''
+        size = req.content_length or 0
+        retry_after_s = self.admission.reserve(size)
+        if retry_after_s > 0:
+            return self.overloaded_response(req_uuid, retry_after_s)
         try:
-            body = await req.json()
+            try:
+                body = await self.read_json(req)
+                header = body['header']
+                addr = header['src_addr']
+                req_uuid = header['uuid']
+            except asyncio.TimeoutError:
+                return self.read_timeout_response(req_uuid)
+            except KeyError:
+                return web.json_response({
+                    'headers': {'src_addr': self.src_addr, 'uuid': req_uuid},
+                    'error_data': {
+                        'error_code': HTTPServer.CORRUPTED_BODY_CODE,
+                        'error_info': 'corrupted request body',
+                        'error_text': 'unable to read request body'
+                    }
+                }, status=HTTPServer.STATUS_BAD_REQUEST)
+
+            retry_after_s = self.admission.check_rate(addr, req.remote)
+            if retry_after_s > 0:
+                return self.rate_limited_response(req_uuid, retry_after_s)
+
+            if await self.forward(HTTPServer.API_NOTIFY_ADD_CONTROL_OBJECT, body) == '':
+                return self.unable_to_send_response(req_uuid)
+            return web.json_response({'headers': {'src_addr': self.src_addr, 'uuid': req_uuid}})
+        finally:
+            self.admission.release(size)
+
+    async def on_put_control(self, req: web.Request) -> web.Response:
+        req_uuid = ''
+        try:
+            body = await self.read_json(req)
             header = body['header']
-            addr = header['src_addr']
             req_uuid = header['uuid']
-            img_buff = body['img_buff']
-            image_control_objects = body['image_control_objects']
+            command = body['command']
+            review = self.reviews[req_uuid]
+        except asyncio.TimeoutError:
+            return self.read_timeout_response(req_uuid)
         except KeyError:
             return web.json_response({
                 'headers': {'src_addr': self.src_addr, 'uuid': req_uuid},
                 'error_data': {
                     'error_code': HTTPServer.CORRUPTED_BODY_CODE,
                     'error_info': 'corrupted request body',
-                    'error_text': 'unable to read request body'
+                    'error_text': 'unable to read request body or unknown uuid'
                 }
             }, status=HTTPServer.STATUS_BAD_REQUEST)
 
-        msg = body
-        outmq = janus.Queue(loop=self.loop)
-        p = ('notify_control', msg, outmq)
-        self.gui.mq.sync_q.put(p)
-        self.gui.notify_gui()
-
-        asyncio.run_coroutine_threadsafe(self.notify_control_create_resp(outmq), loop=self.loop)
+        self.panels.get(review['panel'], set()).discard(req_uuid)
+        if review['body'] is not None:
+            self.admission.release(review['size'])
+        if command == Dispatcher.COMMAND_PROCESS_AGAIN:
+            review['body'] = None
+        else:
+            self.reviews.pop(req_uuid)
+        header['src_addr'] = self.src_addr
+        self.spawn(self.put_control(review['facedb_addr'], body))
         return web.json_response({'headers': {'src_addr': self.src_addr, 'uuid': req_uuid}})
 
-    async def notify_control_create_resp(self, outmq: janus.Queue):
-        data = await outmq.async_q.get()
-        addr = data[0]
-        msg = data[1]
-        async with ClientSession(
-                json_serialize=json.dumps) as session:
-            await session.put(addr + HTTPServer.RESP_API_V1_PUT_CONTROL, json=msg)
-
-    async def notify_add_control_object(self, req: web.Request) -> web.Response:
+    async def register_panel(self, req: web.Request) -> web.Response:
         req_uuid = ''
         try:
-            body = await req.json()
+            body = await self.read_json(req)
             header = body['header']
             addr = header['src_addr']
             req_uuid = header['uuid']
+        except asyncio.TimeoutError:
+            return self.read_timeout_response(req_uuid)
         except KeyError:
             return web.json_response({
                 'headers': {'src_addr': self.src_addr, 'uuid': req_uuid},
@@ -899,13 +3141,71 @@ class HTTPServer:
                 }
             }, status=HTTPServer.STATUS_BAD_REQUEST)
 
-        msg = body
-        p = ('notify_add_control_object', msg)
-        self.gui.mq.sync_q.put(p)
-        self.gui.notify_gui()
-
+        if addr not in self.panels:
+            print('panel "%s" registered' % addr)
+            self.panels[addr] = set()
+        self.dead_panels.discard(addr)
+        self.failures.pop(addr, None)
         return web.json_response({'headers': {'src_addr': self.src_addr, 'uuid': req_uuid}})
 
+    async def check_panels(self):
+        """Checks panels health and reroutes pending reviews of dead panels.
+
+        Panel gets no new reviews after the first failed check, but its pending reviews are rerouted
+        only after reroute_after_failures consecutive failed checks, so stalled panel doesn't show
+        reviews, that are reviewed on another panel too.
+        """
+        while True:
+            try:
+                await self.check_panels_once()
+            except Exception as e:
+                print('unable to check panels: %s' % e)
+            await asyncio.sleep(self.cfg.dispatcher_cfg.health_check_interval_s)
+
+    async def check_panels_once(self):
+        for addr in list(self.panels):
+            try:
+                async with self.get_session().get(addr + HTTPServer.API_STATS, timeout=self.get_timeout()) as resp:
+                    alive = resp.status == 200
+            except Exception:
+                alive = False
+            if alive:
+                self.dead_panels.discard(addr)
+                self.failures.pop(addr, None)
+                continue
+            if addr not in self.dead_panels:
+                print('panel "%s" is unavailable' % addr)
+                self.dead_panels.add(addr)
+            self.failures[addr] = self.failures.get(addr, 0) + 1
+        for addr in list(self.dead_panels):
+            if self.failures.get(addr, 0) < self.cfg.dispatcher_cfg.reroute_after_failures:
+                continue
+            for req_uuid in list(self.panels.get(addr, ())):
+                # Panel may answer review or come back alive, while other reviews are rerouted.
+                review = self.reviews.get(req_uuid)
+                if addr not in self.dead_panels or review is None or review['panel'] != addr or \
+                        review['body'] is None:
+                    continue
+                self.panels[addr].discard(req_uuid)
+                try:
+                    rerouted = await self.dispatch_review(req_uuid)
+                except Exception as e:
+                    print('unable to reroute review "%s": %s' % (req_uuid, e))
+                    rerouted = False
+                if not rerouted and self.reviews.get(req_uuid) is review:
+                    self.panels[addr].add(req_uuid)
+
+
+def new_event_loop(kind: str) -> asyncio.AbstractEventLoop:
+    """Creates event loop of given kind: "asyncio" or "uvloop" (if uvloop package is installed)."""
+    if kind == 'uvloop':
+        try:
+            import uvloop
+            return uvloop.new_event_loop()
+        except ImportError:
+            print('uvloop is not installed, using default event loop')
+    return asyncio.new_event_loop()
+
 
 DESC_STR = r"""FaceRecognition is a simple script, that finds all faces in image
 and returns their coordinates and features vectors.
@@ -919,6 +3219,14 @@ def parse_args():
     parser.add_argument('-v', '--version', action='version', version='%(prog)s v0.1')
     parser.add_argument('-c', '--config', type=str, default='',
                         help='path to yaml config file')
+    parser.add_argument('--headless', action='store_true',
+                        help='run without GUI, all notifications are decided by auto decision rules')
+    parser.add_argument('--dispatcher', action='store_true',
+                        help='run as dispatcher, balancing notifications between several panels')
+    parser.add_argument('-p', '--port', type=int, default=0,
+                        help='HTTP server port (overrides config file)')
+    parser.add_argument('--startup-profile', action='store_true',
+                        help='print timings of startup phases')
 
     args = parser.parse_args()
 
@@ -927,22 +3235,59 @@ def parse_args():
 
 def main():
     args = parse_args()
-    with open(args.config, 'r') as stream:
-        fcfg = yaml.safe_load(stream)
-        cfg = CFG(fcfg)
-
-    loop = asyncio.new_event_loop()
-    mq = janus.Queue(loop=loop)
+    profile = StartupProfile(args.startup_profile)
+    profile.add('imports', IMPORTS_STARTED_AT, time.perf_counter())
+    with profile.phase('config'):
+        with open(args.config, 'r') as stream:
+            fcfg = yaml.safe_load(stream)
+            cfg = CFG(fcfg)
+        if args.port != 0:
+            cfg.http_server_cfg.port = args.port
+
+    loop = new_event_loop(cfg.http_server_cfg.event_loop)
+    scheduler = PriorityScheduler(cfg.scheduler_cfg.aging_s, cfg.scheduler_cfg.expected_ttl_s)
     if cfg.http_server_cfg.key_path != '' and cfg.http_server_cfg.crt_path != '':
         src_addr = 'https://' + cfg.http_server_cfg.addr + ':' + str(cfg.http_server_cfg.port)
     else:
         src_addr = 'http://' + cfg.http_server_cfg.addr + ':' + str(cfg.http_server_cfg.port)
-    gui = GUI(mq, src_addr, cfg.facedb_cfg.addr)
-    http_server = HTTPServer(cfg, src_addr, loop, gui)
+    watchdog = None
+    if cfg.watchdog_cfg.enabled:
+        watchdog = StallWatchdog(cfg.watchdog_cfg.interval_ms / 1000, cfg.watchdog_cfg.stall_threshold_ms / 1000)
+        watchdog.start()
+    profiler = SamplingProfiler(cfg.profiler_cfg.interval_ms / 1000, cfg.profiler_cfg.out_dir)
+    history = None
+    if cfg.history_cfg.path != '' and not args.dispatcher:
+        with profile.phase('history'):
+            history = HistoryStore(os.path.expanduser(cfg.history_cfg.path), cfg.history_cfg.max_rows,
+                                   cfg.history_cfg.max_age_days, cfg.history_cfg.thumbnail_size)
+            history.start()
+    if args.dispatcher:
+        dispatcher = Dispatcher(cfg, src_addr, loop, profile, watchdog, profiler)
+        dispatcher.run()
+        return
+    http_server = HTTPServer(cfg, src_addr, loop, scheduler, args.headless, profile, watchdog, profiler, history)
+    if args.headless:
+        http_server.run()
+        return
+    # HTTP server starts accepting (and queuing) notifications, while GUI is being built.
     t = threading.Thread(target=http_server.run, name='http_server')
     t.daemon = True
     t.start()
-    gui.show()
+    with profile.phase('gui'):
+        gui = GUI(scheduler, src_addr, cfg.facedb_cfg.addr, cfg.export_cfg, watchdog, profiler,
+                  cfg.profiler_cfg.duration_s, history, cfg.history_cfg, cfg.find_cfg)
+    http_server.attach_gui(gui)
+
+    def on_started():
+        http_server.started.wait(HTTPServer.START_TIMEOUT_S)
+        profile.report()
+
+    gui.show(on_started)
+    # Qt loop doesn't beat after GUI exits, it must not be reported as stalled, while HTTP server stops.
+    if watchdog is not None:
+        watchdog.unwatch(MainWindow.WATCHDOG_LOOP_NAME)
+    http_server.stop()
+    t.join()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,63 @@
+import time
+
+from controlpanel import AdmissionCFG, AdmissionControl
+
+
+def new_admission(**cfg):
+    return AdmissionControl(AdmissionCFG(cfg))
+
+
+def test_rate_disabled():
+    admission = new_admission()
+    assert all(admission.check_rate('src', '127.0.0.1') == 0 for _ in range(1000))
+    assert len(admission.buckets) == 0
+
+
+def test_burst_and_retry_after():
+    admission = new_admission(rate_per_s=10, burst=3)
+    assert [admission.check_rate('src') for _ in range(3)] == [0, 0, 0]
+    retry_after_s = admission.check_rate('src')
+    assert 0 < retry_after_s <= 0.1
+    assert admission.stats()['rejected_rate'] == 1
+    # Other sources have their own buckets.
+    assert admission.check_rate('other') == 0
+
+
+def test_varying_src_addr_is_limited_by_remote():
+    admission = new_admission(rate_per_s=10, burst=3)
+    results = [admission.check_rate('src%d' % i, '10.0.0.1') for i in range(5)]
+    assert results[:3] == [0, 0, 0]
+    assert all(r > 0 for r in results[3:])
+
+
+def test_idle_buckets_are_swept():
+    admission = new_admission(rate_per_s=100, burst=2)
+    for i in range(50):
+        admission.check_rate('src%d' % i, '10.0.0.%d' % i)
+    assert len(admission.buckets) == 100
+    time.sleep(0.05)
+    admission.check_rate('last', '10.0.1.1')
+    assert len(admission.buckets) == 2
+
+
+def test_capacity():
+    admission = new_admission(max_pending_reviews=2, max_pending_bytes=100, retry_after_s=7)
+    assert admission.reserve(10) == 0
+    assert admission.reserve(95) == 7
+    assert admission.reserve(10) == 0
+    assert admission.reserve(1) == 7
+    assert admission.stats()['pending_reviews'] == 2
+    admission.release(10)
+    admission.release(10)
+    assert admission.reserve(100) == 0
+    assert admission.stats()['rejected_overload'] == 2
+
+
+def test_resize():
+    admission = new_admission(max_pending_bytes=100)
+    assert admission.reserve(0) == 0
+    admission.resize(0, 60)
+    assert admission.reserve(50) > 0
+    admission.release(60)
+    assert admission.stats()['pending_bytes'] == 0
+    assert admission.stats()['pending_reviews'] == 0
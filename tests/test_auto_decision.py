@@ -0,0 +1,80 @@
+import asyncio
+import os
+
+import pytest
+import yaml
+from aiohttp.test_utils import TestClient, TestServer
+
+from controlpanel import CFG, AutoDecisionCFG, AutoDecisionPolicy, HTTPServer
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'config.yaml')
+
+KNOWN = {'control_object': {'id': '42'}, 'score': 0.9}
+UNKNOWN = {'control_object': {'id': '-'}, 'score': 0.3}
+
+RULES = [
+    {'condition': 'no_faces', 'command': 'cancel'},
+    {'condition': 'all_known', 'command': 'submit'},
+]
+
+
+def new_policy(rules=RULES, enabled=True, headless=False, headless_command='cancel'):
+    return AutoDecisionPolicy(AutoDecisionCFG({'enabled': enabled, 'rules': rules,
+                                               'headless_command': headless_command}), headless)
+
+
+def test_rules():
+    policy = new_policy()
+    assert policy.decide([]) == 'cancel'
+    assert policy.decide([KNOWN, KNOWN]) == 'submit'
+    assert policy.decide([KNOWN, UNKNOWN]) is None
+    stats = policy.stats()
+    assert (stats['total'], stats['submit'], stats['cancel'], stats['manual']) == (3, 1, 1, 1)
+    assert stats['auto_rate'] == pytest.approx(2 / 3)
+
+
+def test_min_score():
+    policy = new_policy([{'condition': 'min_score', 'threshold': 0.8, 'command': 'submit'}])
+    assert policy.decide([KNOWN]) == 'submit'
+    assert policy.decide([KNOWN, UNKNOWN]) is None
+    assert policy.decide([{'control_object': {'id': '1'}}]) is None
+    assert policy.decide([]) is None
+
+
+def test_disabled_and_headless():
+    assert new_policy(enabled=False).decide([]) is None
+    assert new_policy(enabled=False, headless=True, headless_command='submit').decide([UNKNOWN]) == 'submit'
+
+
+def test_invalid_rules():
+    with pytest.raises(ValueError):
+        new_policy([{'condition': 'unknown', 'command': 'submit'}])
+    with pytest.raises(ValueError):
+        new_policy([{'condition': 'no_faces', 'command': 'process_again'}])
+    with pytest.raises(ValueError):
+        new_policy(headless_command='drop')
+
+
+def test_null_faces():
+    async def notify():
+        with open(CONFIG_PATH) as f:
+            cfg = CFG(yaml.safe_load(f))
+        cfg.auto_decision_cfg = AutoDecisionCFG({'enabled': True, 'rules': RULES})
+        server = HTTPServer(cfg, 'http://127.0.0.1:0', asyncio.get_event_loop(), None, False)
+        replies = []
+
+        async def put_control(addr, msg):
+            replies.append(msg)
+
+        server.put_control = put_control
+        async with TestClient(TestServer(server.app)) as client:
+            resp = await client.put(HTTPServer.API_NOTIFY_CONTROL, json={
+                'header': {'src_addr': 'facedb', 'uuid': 'u1'}, 'img_buff': '', 'image_control_objects': None})
+            assert resp.status == 200
+            await asyncio.gather(*server.tasks)
+        return server, replies
+
+    server, replies = asyncio.run(notify())
+    assert [msg['command'] for msg in replies] == ['cancel']
+    assert server.policy.stats()['total'] == 1
+    assert server.admission.stats()['pending_reviews'] == 0
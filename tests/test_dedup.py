@@ -0,0 +1,125 @@
+import random
+import time
+
+import pytest
+
+from controlpanel import DedupCFG, DuplicateFilter
+
+
+def new_filter(max_distance=4, window_s=10, mode='answer'):
+    return DuplicateFilter(DedupCFG({'enabled': True, 'max_distance': max_distance, 'window_s': window_s,
+                                     'mode': mode}))
+
+
+def flip(h, bits):
+    for bit in bits:
+        h ^= 1 << bit
+    return h
+
+
+@pytest.mark.parametrize('max_distance', range(0, 12))
+def test_bands_cover_hash(max_distance):
+    f = new_filter(max_distance=max_distance)
+    assert len(f.bands) == max_distance + 1
+    covered = 0
+    for shift, mask in f.bands:
+        assert covered & (mask << shift) == 0
+        covered |= mask << shift
+    assert covered == (1 << DuplicateFilter.HASH_BITS) - 1
+
+
+@pytest.mark.parametrize('max_distance', [0, 3, 4, 7])
+def test_find_matches_brute_force(max_distance):
+    rnd = random.Random(max_distance)
+    f = new_filter(max_distance=max_distance, window_s=1000)
+    hashes = [rnd.getrandbits(DuplicateFilter.HASH_BITS) for _ in range(500)]
+    for i in range(len(hashes)):
+        f.check('u%d' % i, hashes[i])
+    now = time.monotonic()
+    for i in range(200):
+        distance = rnd.randint(0, max_distance + 2)
+        h = flip(hashes[i], rnd.sample(range(DuplicateFilter.HASH_BITS), distance))
+        best = min(DuplicateFilter.distance(h, other) for other in hashes)
+        entry = f.find(h, now)
+        if best > max_distance:
+            assert entry is None
+        else:
+            assert entry is not None
+            assert DuplicateFilter.distance(h, entry['hash']) == best
+
+
+def test_find_returns_closest():
+    f = new_filter(max_distance=4)
+    h = random.Random(1).getrandbits(DuplicateFilter.HASH_BITS)
+    f.check('far', flip(h, [0, 1, 2]))
+    f.check('near', flip(h, [40, 50]))
+    assert f.find(h, time.monotonic())['uuid'] == 'near'
+
+
+def test_window_expiry():
+    f = new_filter(window_s=5)
+    h = 0x0123456789abcdef
+    f.check('u1', h)
+    now = time.monotonic()
+    assert f.find(h, now + 4) is not None
+    assert f.find(h, now + 6) is None
+    assert len(f.entries) == 0
+    assert all(len(table) == 0 for table in f.tables)
+    # Expired pending review is still decided normally.
+    assert f.check('u2', h)[0] == DuplicateFilter.ACTION_NEW
+
+
+def test_merge_and_decided():
+    f = new_filter(mode='merge')
+    h = 0x0123456789abcdef
+    action, original = f.check('u1', h)
+    assert action == DuplicateFilter.ACTION_NEW
+    action, entry = f.check('u2', flip(h, [3]))
+    assert action == DuplicateFilter.ACTION_MERGE and entry is original
+    entry['duplicates'].append('d2')
+
+    # process_again keeps review pending with its duplicates.
+    assert f.decided(original, {'command': 'process_again'}) == []
+    assert 'u1' in f.pending
+    assert f.check('u3', h)[0] == DuplicateFilter.ACTION_MERGE
+
+    icos = [{'control_object': {'id': '1'}}]
+    assert f.decided(original, {'command': 'submit', 'image_control_objects': icos}) == ['d2']
+    assert 'u1' not in f.pending
+    assert original['duplicates'] == []
+    # In merge mode decided review doesn't absorb new notifications.
+    assert f.check('u4', h)[0] == DuplicateFilter.ACTION_NEW
+
+
+def test_answer_with_decision():
+    f = new_filter(mode='answer')
+    h = 0x0123456789abcdef
+    _, original = f.check('u1', h)
+    icos = [{'control_object': {'id': '1'}}]
+    f.decided(original, {'command': 'submit', 'image_control_objects': icos})
+    action, entry = f.check('u2', flip(h, [1, 2]))
+    assert action == DuplicateFilter.ACTION_ANSWER and entry is original
+    msg = DuplicateFilter.answer(entry, 'http://panel', 'u2')
+    assert msg == {'header': {'src_addr': 'http://panel', 'uuid': 'u2'}, 'command': 'submit',
+                   'image_control_objects': icos}
+
+    _, cancelled = f.check('u3', ~h & ((1 << DuplicateFilter.HASH_BITS) - 1))
+    f.decided(cancelled, {'command': 'cancel'})
+    assert 'image_control_objects' not in DuplicateFilter.answer(cancelled, 'http://panel', 'u4')
+    assert f.stats()['answer'] == 1
+
+
+def test_decided_after_expiry_is_indexed_again():
+    f = new_filter(window_s=5)
+    h = 0x0123456789abcdef
+    _, original = f.check('u1', h)
+    f.expire(time.monotonic() + 6)
+    f.decided(original, {'command': 'cancel'})
+    assert f.find(h, time.monotonic()) is original
+
+
+def test_invalid_config():
+    with pytest.raises(ValueError):
+        new_filter(mode='drop')
+    with pytest.raises(ValueError):
+        new_filter(max_distance=DuplicateFilter.HASH_BITS)
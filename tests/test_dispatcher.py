@@ -0,0 +1,168 @@
+import asyncio
+import os
+
+import yaml
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from controlpanel import CFG, Dispatcher, HTTPServer
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'config.yaml')
+
+
+class Stub:
+    """Stub of ControlPanel (or FaceDB), that records received bodies."""
+
+    def __init__(self):
+        self.received = []
+        self.alive = True
+        # hold, if set, delays answers to notifications till it is released.
+        self.hold = None
+        self.holding = asyncio.Event()
+        app = web.Application()
+        app.add_routes([web.put(HTTPServer.API_NOTIFY_CONTROL, self.on_body),
+                        web.put(Dispatcher.API_PUT_CONTROL, self.on_body),
+                        web.get(HTTPServer.API_STATS, self.on_stats)])
+        self.server = TestServer(app)
+
+    @property
+    def addr(self) -> str:
+        return 'http://%s:%d' % (self.server.host, self.server.port)
+
+    def uuids(self) -> list:
+        return [body['header']['uuid'] for body in self.received]
+
+    async def on_body(self, req: web.Request) -> web.Response:
+        self.received.append(await req.json())
+        if self.hold is not None:
+            self.holding.set()
+            await self.hold.wait()
+        return web.json_response({})
+
+    async def on_stats(self, req: web.Request) -> web.Response:
+        return web.json_response({}, status=200 if self.alive else 500)
+
+
+def run(test, panels=2, **dispatcher_cfg):
+    """Runs test(dispatcher, client, panels, facedb) against dispatcher, that balances between stub panels."""
+
+    async def main():
+        stubs = [Stub() for _ in range(panels)]
+        facedb = Stub()
+        for stub in stubs + [facedb]:
+            await stub.server.start_server()
+        with open(CONFIG_PATH) as f:
+            cfg = CFG(yaml.safe_load(f))
+        cfg.dispatcher_cfg.panels = [stub.addr for stub in stubs]
+        for key, value in dispatcher_cfg.items():
+            setattr(cfg.dispatcher_cfg, key, value)
+        dispatcher = Dispatcher(cfg, 'http://dispatcher', asyncio.get_event_loop())
+        try:
+            async with TestClient(TestServer(dispatcher.app)) as client:
+                await test(dispatcher, client, stubs, facedb)
+                await asyncio.gather(*dispatcher.tasks)
+        finally:
+            if dispatcher.session is not None:
+                await dispatcher.session.close()
+            for stub in stubs + [facedb]:
+                await stub.server.close()
+
+    asyncio.run(main())
+
+
+async def notify(client, facedb, req_uuid: str) -> int:
+    resp = await client.put(HTTPServer.API_NOTIFY_CONTROL, json={
+        'header': {'src_addr': facedb.addr, 'uuid': req_uuid}, 'img_buff': '', 'image_control_objects': []})
+    return resp.status
+
+
+async def put_control(client, req_uuid: str, command: str) -> int:
+    resp = await client.put(Dispatcher.API_PUT_CONTROL, json={
+        'header': {'src_addr': 'panel', 'uuid': req_uuid}, 'command': command})
+    return resp.status
+
+
+def test_choose_panels():
+    async def test(dispatcher, client, panels, facedb):
+        first, second, third = (panel.addr for panel in panels)
+        dispatcher.panels[first].update(('u1', 'u2'))
+        dispatcher.panels[third].add('u3')
+        assert dispatcher.choose_panels('') == [second, third, first]
+        assert dispatcher.choose_panels(first) == [first, second, third]
+        dispatcher.dead_panels.add(second)
+        assert dispatcher.choose_panels('') == [third, first]
+
+        assert await notify(client, facedb, 'u4') == 200
+        assert panels[1].uuids() == []
+        assert panels[2].uuids() == ['u4']
+
+    run(test, panels=3)
+
+
+def test_process_again_is_sticky():
+    async def test(dispatcher, client, panels, facedb):
+        assert await notify(client, facedb, 'u1') == 200
+        assert panels[0].uuids() == ['u1']
+        dispatcher.panels[panels[0].addr].update(('u2', 'u3'))
+
+        assert await put_control(client, 'u1', Dispatcher.COMMAND_PROCESS_AGAIN) == 200
+        assert await notify(client, facedb, 'u1') == 200
+        assert panels[0].uuids() == ['u1', 'u1']
+        assert panels[1].uuids() == []
+        assert dispatcher.reviews['u1']['panel'] == panels[0].addr
+
+    run(test)
+
+
+def test_answered_while_forwarded():
+    async def test(dispatcher, client, panels, facedb):
+        panels[0].hold = asyncio.Event()
+        notified = asyncio.ensure_future(notify(client, facedb, 'u1'))
+        await panels[0].holding.wait()
+        assert await put_control(client, 'u1', 'submit') == 200
+        panels[0].hold.set()
+        assert await notified == 200
+
+        assert 'u1' not in dispatcher.reviews
+        assert dispatcher.panels[panels[0].addr] == set()
+        assert dispatcher.admission.stats()['pending_reviews'] == 0
+
+    run(test)
+
+
+def test_reroute_after_failures():
+    async def test(dispatcher, client, panels, facedb):
+        assert await notify(client, facedb, 'u1') == 200
+        panels[0].alive = False
+
+        await dispatcher.check_panels_once()
+        assert panels[0].addr in dispatcher.dead_panels
+        assert dispatcher.reviews['u1']['panel'] == panels[0].addr
+        assert panels[1].uuids() == []
+
+        await dispatcher.check_panels_once()
+        assert dispatcher.reviews['u1']['panel'] == panels[1].addr
+        assert dispatcher.panels[panels[0].addr] == set()
+        assert panels[1].uuids() == ['u1']
+
+    run(test, reroute_after_failures=2)
+
+
+def test_admission_released_on_put_control():
+    async def test(dispatcher, client, panels, facedb):
+        assert await notify(client, facedb, 'u1') == 200
+        assert await notify(client, facedb, 'u2') == 200
+        assert dispatcher.admission.stats()['pending_reviews'] == 2
+
+        assert await put_control(client, 'u1', 'submit') == 200
+        assert await put_control(client, 'u2', Dispatcher.COMMAND_PROCESS_AGAIN) == 200
+        assert dispatcher.admission.stats()['pending_reviews'] == 0
+        assert dispatcher.admission.stats()['pending_bytes'] == 0
+        assert await put_control(client, 'u2', 'submit') == 200
+        assert dispatcher.admission.stats()['pending_reviews'] == 0
+        assert list(dispatcher.reviews) == []
+
+        await asyncio.gather(*dispatcher.tasks)
+        assert sorted(facedb.uuids()) == ['u1', 'u2', 'u2']
+
+    run(test)
@@ -0,0 +1,81 @@
+import time
+
+import pytest
+
+from controlpanel import HistoryStore
+
+DAY_S = 24 * 3600
+
+
+def face(passport: str, surname: str) -> dict:
+    return {'control_object': {'id': passport, 'passport': passport, 'surname': surname,
+                               'name': 'N', 'patronymic': 'P'}}
+
+
+@pytest.fixture
+def history(tmp_path):
+    return HistoryStore(str(tmp_path / 'history.sqlite'), 0, 0)
+
+
+def insert(history: HistoryStore, req_uuid: str, faces: list, img_bytes: bytes = b'', ts: float = None):
+    conn = history.connection()
+    review = {'uuid': req_uuid, 'status': 'submit', 'image_control_objects': faces}
+    with conn:
+        history._HistoryStore__insert(conn, time.time() if ts is None else ts, review, img_bytes, None)
+
+
+def uuids(rows: list) -> list:
+    return [row[3] for row in rows]
+
+
+def count(history: HistoryStore, table: str) -> int:
+    return history.connection().execute('SELECT COUNT(*) FROM %s' % table).fetchone()[0]
+
+
+def test_search(history):
+    insert(history, 'u1', [face('p1', 'Ivanov'), face('p2', 'Petrov')], b'img1', ts=1)
+    insert(history, 'u2', [face('p3', 'Ivanova')], b'img2', ts=2)
+    insert(history, 'u3', None, b'img3', ts=3)
+
+    assert uuids(history.search(HistoryStore.FIELD_PASSPORT, 'p2', 10)) == ['u1', 'u1']
+    assert uuids(history.search(HistoryStore.FIELD_SURNAME, 'Ivanov', 10)) == ['u2', 'u1', 'u1']
+    assert uuids(history.search(HistoryStore.FIELD_SURNAME, 'Ivanova', 10)) == ['u2']
+    assert uuids(history.search(HistoryStore.FIELD_SURNAME, 'Sidorov', 10)) == []
+    assert uuids(history.search(HistoryStore.FIELD_UUID, 'u3', 10)) == ['u3']
+    assert uuids(history.search(HistoryStore.FIELD_IMG_HASH, HistoryStore.img_hash(b'img2'), 10)) == ['u2']
+    hashes = (HistoryStore.img_hash(b'img1'), HistoryStore.img_hash(b'img3'), HistoryStore.img_hash(b'none'))
+    assert uuids(history.search(HistoryStore.FIELD_IMG_HASH, hashes, 10)) == ['u3', 'u1', 'u1']
+    assert len(history.search(HistoryStore.FIELD_SURNAME, 'I', 1)) == 1
+    with pytest.raises(ValueError):
+        history.search('name', 'N', 10)
+
+
+def test_prune_by_rows(history):
+    history.max_rows = 2
+    for i in range(5):
+        insert(history, 'u%d' % i, [face('p%d' % i, 'S')])
+    conn = history.connection()
+    with conn:
+        history._HistoryStore__prune(conn)
+    assert uuids(history.search(HistoryStore.FIELD_SURNAME, 'S', 10)) == ['u4', 'u3']
+
+
+def test_prune_by_age(history):
+    history.max_age_days = 1
+    insert(history, 'old', [face('p1', 'S')], ts=time.time() - 2 * DAY_S)
+    insert(history, 'new', [face('p2', 'S')], ts=time.time() - DAY_S / 2)
+    conn = history.connection()
+    with conn:
+        history._HistoryStore__prune(conn)
+    assert uuids(history.search(HistoryStore.FIELD_SURNAME, 'S', 10)) == ['new']
+
+
+def test_delete_cascades_to_faces(history):
+    insert(history, 'u1', [face('p1', 'S'), face('p2', 'S')])
+    insert(history, 'u2', [face('p3', 'S')])
+    assert count(history, 'faces') == 3
+    conn = history.connection()
+    with conn:
+        conn.execute("DELETE FROM reviews WHERE uuid = 'u1'")
+    assert count(history, 'faces') == 1
+    assert history.search(HistoryStore.FIELD_PASSPORT, 'p1', 10) == []
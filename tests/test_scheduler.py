@@ -0,0 +1,48 @@
+import time
+
+from controlpanel import PriorityScheduler
+
+
+def notification(req_uuid):
+    return 'notify_control', {'header': {'uuid': req_uuid}}, None
+
+
+def test_classes_order():
+    s = PriorityScheduler(aging_s=1000)
+    s.expect('again', PriorityScheduler.CLASS_PROCESS_AGAIN)
+    s.expect('find', PriorityScheduler.CLASS_FIND)
+    for req_uuid in ('background', 'again', 'find'):
+        s.put(notification(req_uuid))
+    assert s.qsize() == 3
+    assert [s.get()[1]['header']['uuid'] for _ in range(3)] == ['find', 'again', 'background']
+    assert s.stats()[PriorityScheduler.CLASS_FIND]['count'] == 1
+
+
+def test_aging():
+    s = PriorityScheduler(aging_s=0.05)
+    s.put(notification('background'))
+    time.sleep(0.15)
+    s.expect('find', PriorityScheduler.CLASS_FIND)
+    s.put(notification('find'))
+    assert s.get()[1]['header']['uuid'] == 'background'
+
+
+def test_expected_is_consumed_and_forgotten():
+    s = PriorityScheduler(aging_s=30)
+    s.expect('a', PriorityScheduler.CLASS_FIND)
+    s.expect('b', PriorityScheduler.CLASS_FIND)
+    assert s.is_expected('a')
+    s.put(notification('a'))
+    assert not s.is_expected('a')
+    s.forget('b')
+    assert not s.is_expected('b')
+    s.forget('unknown')
+
+
+def test_expected_expire():
+    s = PriorityScheduler(aging_s=30, expected_ttl_s=0.05)
+    s.expect('old', PriorityScheduler.CLASS_FIND)
+    time.sleep(0.1)
+    s.expect('new', PriorityScheduler.CLASS_FIND)
+    assert not s.is_expected('old')
+    assert s.is_expected('new')